@@ -5,16 +5,16 @@
 使用動態門檻 (Dynamic Thresholding)：市場平靜時更敏銳，暴風雨時更穩健
 """
 
-import yfinance as yf
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 import os
-from dynamic_threshold import apply_dynamic_threshold, get_dynamic_threshold
-
-plt.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei"]
-plt.rcParams["axes.unicode_minus"] = False
+from yf_cache import cached_download
+from dynamic_threshold import apply_dynamic_threshold
+from table_image import save_table_image
+from backtest_kernels import label_hold
 
 US_TICKER = "QQQ"
 TW_STOCKS = {
@@ -31,74 +31,82 @@ BASE_LOW, BASE_HIGH = 0.7, 1.8
 VOL_LOW, VOL_HIGH = 0.6, 1.4  # 波動率分界（%）
 
 
-def fetch_us_data():
+def fetch_all_data() -> dict:
+    """
+    一次下載美股 QQQ 與所有台股標的（單一 multi-ticker 請求）
+    :return: {ticker: DataFrame}
+    """
     end = datetime.now().strftime("%Y-%m-%d")
-    us = yf.download(US_TICKER, start=START_DATE, end=end, progress=False, auto_adjust=True)
-    if isinstance(us.columns, pd.MultiIndex):
-        us.columns = us.columns.get_level_values(0)
-    return us
+    tickers = [US_TICKER] + list(TW_STOCKS)
+    data = cached_download(
+        " ".join(tickers),
+        start=START_DATE,
+        end=end,
+        progress=False,
+        auto_adjust=True,
+        group_by="ticker",
+        threads=True,
+    )
+    result = {}
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.get_level_values(0):
+            # 美股、台股交易日不同，合併後需去掉該標的全為 NaN 的日期
+            result[ticker] = data[ticker].dropna(how="all")
+        else:
+            result[ticker] = pd.DataFrame()
+    return result
 
 
-def fetch_tw_data(ticker: str):
-    end = datetime.now().strftime("%Y-%m-%d")
-    tw = yf.download(ticker, start=START_DATE, end=end, progress=False, auto_adjust=True)
-    if isinstance(tw.columns, pd.MultiIndex):
-        tw.columns = tw.columns.get_level_values(0)
-    return tw
+def prepare_us(us: pd.DataFrame) -> pd.DataFrame:
+    """
+    美股端欄位（報酬、20 日波動率、當日動態門檻）只與 QQQ 有關，
+    於 run() 計算一次後供所有台股標的共用
+    :return: 含 us_ret, vol_20d, threshold_crash, threshold_surge 的 DataFrame
+    """
+    return apply_dynamic_threshold(
+        us, window=20, base_low=BASE_LOW, base_high=BASE_HIGH, vol_low=VOL_LOW, vol_high=VOL_HIGH
+    )
 
 
-def align_and_label_dynamic(us: pd.DataFrame, tw: pd.DataFrame) -> pd.DataFrame:
+def align_and_label_dynamic(us_enriched: pd.DataFrame, tw: pd.DataFrame) -> pd.DataFrame:
     """
     使用動態門檻：每日依 20 日波動率調整大跌/大漲判斷
+    :param us_enriched: prepare_us() 的結果
     """
-    us_enriched = apply_dynamic_threshold(us, window=20, base_low=BASE_LOW, base_high=BASE_HIGH)
-    us_enriched["us_ret"] = us_enriched["Close"].pct_change()  # 小數
-
-    tw = tw[["Open", "High", "Close"]].copy()
-    common = us_enriched.index.intersection(tw.index).sort_values()
-    result = []
-    for i, d in enumerate(common):
-        if i == 0 or i + 2 >= len(common):
-            continue
-        prev_d = common[i - 1]
-        us_prev_ret = us_enriched.loc[prev_d, "us_ret"] if prev_d in us_enriched.index else np.nan
-        if np.isnan(us_prev_ret):
-            continue
-
-        # 動態門檻：用 prev_d 當下的波動率
-        vol = us_enriched.loc[prev_d, "vol_20d"] if prev_d in us_enriched.index else np.nan
-        th_crash, th_surge = get_dynamic_threshold(vol, BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
-
-        buy_price = tw.loc[d, "Open"]
-        d1, d2, d3 = common[i], common[i + 1], common[i + 2]
-        high_3d = max(
-            tw.loc[d1, "High"] if d1 in tw.index else 0,
-            tw.loc[d2, "High"] if d2 in tw.index else 0,
-            tw.loc[d3, "High"] if d3 in tw.index else 0,
-        )
-        win = high_3d > buy_price
-        ret_3d = (tw.loc[d3, "Close"] / buy_price - 1) * 100
-
-        us_ret_pct = us_prev_ret * 100
-        result.append({
-            "date": d,
-            "us_prev_ret": us_ret_pct,
-            "vol_20d": vol,
-            "th_crash": th_crash,
-            "th_surge": th_surge,
-            "win": win,
-            "ret_3d": ret_3d,
-            "is_crash": us_ret_pct < th_crash,
-            "is_surge": us_ret_pct > th_surge,
-        })
-    return pd.DataFrame(result)
-
-
-def run_single(ticker: str, name: str, us: pd.DataFrame) -> dict:
-    tw = fetch_tw_data(ticker)
+    # 以共同交易日 inner join，之後改用 numpy 陣列的位置索引計算
+    merged = us_enriched[["us_ret", "vol_20d", "threshold_crash", "threshold_surge"]].join(
+        tw[["Open", "High", "Close"]], how="inner"
+    ).sort_index()
+    buy_idx, win, ret_3d = label_hold(
+        merged["Open"].to_numpy(dtype=np.float64),
+        merged["High"].to_numpy(dtype=np.float64),
+        merged["Close"].to_numpy(dtype=np.float64),
+        merged["us_ret"].to_numpy(dtype=np.float64),
+        hold_days=3,  # 買入後 3 天（i..i+2）
+        n_forward=2,
+    )
+    # 動態門檻：用 prev_d（買入日前一個共同交易日）當下的波動率與門檻
+    prev_idx = buy_idx - 1
+    us_ret_pct = merged["us_ret"].to_numpy()[prev_idx] * 100
+    th_crash = merged["threshold_crash"].to_numpy()[prev_idx]
+    th_surge = merged["threshold_surge"].to_numpy()[prev_idx]
+    return pd.DataFrame({
+        "date": merged.index[buy_idx],
+        "us_prev_ret": us_ret_pct,
+        "vol_20d": merged["vol_20d"].to_numpy()[prev_idx],
+        "th_crash": th_crash,
+        "th_surge": th_surge,
+        "win": win,
+        "ret_3d": ret_3d,
+        "is_crash": us_ret_pct < th_crash,
+        "is_surge": us_ret_pct > th_surge,
+    })
+
+
+def run_single(ticker: str, name: str, us_enriched: pd.DataFrame, tw: pd.DataFrame) -> dict:
     if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
         return None
-    df = align_and_label_dynamic(us, tw)
+    df = align_and_label_dynamic(us_enriched, tw)
     if df.empty:
         return None
     crash_days = df[df["is_crash"]]
@@ -134,27 +142,12 @@ def save_chart(results: list) -> None:
             r["name"], str(r["crash_n"]), str(r["crash_wins"]), f"{r['crash_wr']:.1f}", f"{r['crash_avg']:+.2f}",
             str(r["surge_n"]), str(r["surge_wins"]), f"{r['surge_wr']:.1f}", f"{r['surge_avg']:+.2f}", better
         ])
-    fig, ax = plt.subplots(figsize=(14, len(results) * 0.5 + 3))
-    ax.axis("off")
-    table = ax.table(
-        cellText=data,
-        colLabels=cols,
-        loc="center",
-        cellLoc="center",
-        colColours=["#4472C4"] * 10,
-    )
-    table.auto_set_font_size(False)
-    table.set_fontsize(10)
-    table.scale(1, 2)
-    plt.title(
+    title = (
         f"動態門檻回測（{START_DATE} 至今）\n"
-        f"門檻：市場平靜 0.7% / 暴風雨 1.8%，依 20 日波動率自適應",
-        fontsize=12
+        f"門檻：市場平靜 0.7% / 暴風雨 1.8%，依 20 日波動率自適應"
     )
-    plt.tight_layout()
     out_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backtest_dynamic_result.png")
-    plt.savefig(out_path, dpi=150)
-    plt.close()
+    save_table_image(cols, data, title, out_path)
     print(f"\n圖表已儲存至: {out_path}")
 
 
@@ -175,7 +168,11 @@ def print_recommendations(results: list) -> None:
     print("=" * 60)
 
 
-def run() -> None:
+def run(plot: bool = True) -> None:
+    """
+    執行所有標的回測並輸出彙總表與操作建議
+    :param plot: False 時不輸出結果表圖片（排程 / 無螢幕環境）
+    """
     print("=" * 60)
     print("對比回測：動態門檻（市場平靜更敏銳、暴風雨更穩健）")
     print("=" * 60)
@@ -183,16 +180,19 @@ def run() -> None:
     print("門檻：依 20 日波動率動態調整（0.7% ~ 1.8%）")
     print("策略：隔天開盤買，3 日內有漲即獲利\n")
 
-    us = fetch_us_data()
+    data = fetch_all_data()
+    us = data[US_TICKER]
     if us.empty:
         print("無法取得美股資料")
         return
+    us_enriched = prepare_us(us)
 
-    results = []
-    for ticker, name in TW_STOCKS.items():
-        r = run_single(ticker, name, us)
-        if r:
-            results.append(r)
+    # 各標的互相獨立，以執行緒平行計算（pandas / numpy 運算會釋放 GIL）；map 保持原順序
+    with ThreadPoolExecutor(max_workers=min(8, len(TW_STOCKS))) as ex:
+        results = [
+            r for r in ex.map(lambda kv: run_single(kv[0], kv[1], us_enriched, data[kv[0]]), TW_STOCKS.items())
+            if r
+        ]
 
     print("【彙總表格】")
     print("-" * 95)
@@ -205,9 +205,13 @@ def run() -> None:
         print(f"{r['name']:<12} | {crash_s:<28} | {surge_s:<28} | {better}")
     print("=" * 95)
 
-    save_chart(results)
+    if plot:
+        save_chart(results)
     print_recommendations(results)
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="動態門檻回測")
+    parser.add_argument("--no-plot", action="store_true", help="不輸出結果表圖片")
+    args = parser.parse_args()
+    run(plot=not args.no_plot)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+回測共用核心
+============
+「美股前一日漲跌 → 台股隔天開盤買、持有 N 日」各回測腳本共用的逐日標記（numba 編譯，未安裝時退回純 Python）
+"""
+
+import numpy as np
+from numba_compat import njit
+
+
+@njit(cache=True)
+def label_hold(open_arr, high_arr, close_arr, us_ret, hold_days, n_forward):
+    """
+    第 i 天（1 <= i < n - n_forward）開盤買、持有 hold_days 日
+    :param us_ret: 美股日報酬（與 open_arr 同一組共同交易日）
+    :param hold_days: 持有天數（含買入當天）
+    :param n_forward: 買入日之後至少需保留的交易日數（>= hold_days - 1）
+    :return: (buy_idx, win, ret)，只含前一日有美股報酬的買入日；
+             win 為持有期間最高價是否高於買價，ret 為最後一日收盤報酬（%），該日無收盤時為 NaN
+    """
+    n = open_arr.shape[0]
+    m = max(n - n_forward - 1, 0)
+    # 預先配置輸出欄位，依序寫入有效的日子，最後截取前 cnt 筆
+    buy_idx = np.empty(m, np.int64)
+    win = np.empty(m, np.bool_)
+    ret = np.empty(m, np.float64)
+    cnt = 0
+    for i in range(1, n - n_forward):
+        if np.isnan(us_ret[i - 1]):
+            continue
+        buy = open_arr[i]
+        # 依序比較取最高價；遇缺值時比較皆為 False，與內建 max() 相同
+        high = high_arr[i]
+        for j in range(i + 1, i + hold_days):
+            if high_arr[j] > high:
+                high = high_arr[j]
+        buy_idx[cnt] = i
+        win[cnt] = high > buy
+        ret[cnt] = (close_arr[i + hold_days - 1] / buy - 1) * 100
+        cnt += 1
+    return buy_idx[:cnt], win[:cnt], ret[:cnt]
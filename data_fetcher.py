@@ -3,10 +3,10 @@
 資料取得模組 - 使用 yfinance 下載台股資料
 """
 
-import yfinance as yf
 import pandas as pd
 from typing import Optional
 from config import TECH_STOCKS, START_DATE, END_DATE
+from yf_cache import cached_download
 
 
 def fetch_stock(ticker: str, start: str = START_DATE, end: str = END_DATE) -> pd.DataFrame:
@@ -17,20 +17,57 @@ def fetch_stock(ticker: str, start: str = START_DATE, end: str = END_DATE) -> pd
     :param end: 結束日期
     :return: 含 Open, High, Low, Close, Volume 的 DataFrame
     """
-    data = yf.download(ticker, start=start, end=end, progress=False, auto_adjust=True)
+    data = cached_download(ticker, start=start, end=end, progress=False, auto_adjust=True)
     if isinstance(data.columns, pd.MultiIndex):
         data.columns = data.columns.get_level_values(0)
     return data
 
 
+def fetch_all_panel(start: str = START_DATE, end: str = END_DATE) -> pd.DataFrame:
+    """
+    取得所有前十大科技股資料（單一 multi-ticker 請求，非逐檔下載）
+    各檔共用同一日期索引，可用 panel[ticker] 取單檔，或跨標的一次運算
+    :return: 欄位為 (ticker, Open/High/Low/Close/Volume) 的 DataFrame；取不到資料時為空
+    """
+    data = cached_download(
+        " ".join(TECH_STOCKS),
+        start=start,
+        end=end,
+        progress=False,
+        auto_adjust=True,
+        group_by="ticker",
+        threads=True,
+    )
+    return data
+
+
+def close_panel(start: str = START_DATE, end: str = END_DATE) -> pd.DataFrame:
+    """
+    所有前十大科技股的收盤價矩陣（列：日期，欄：ticker）
+    可一次對全部標的向量化運算，如 close_panel().pct_change().rolling(20).std()
+    """
+    data = fetch_all_panel(start, end)
+    if data.empty or not isinstance(data.columns, pd.MultiIndex):
+        return pd.DataFrame()
+    return data.xs("Close", level=1, axis=1).dropna(axis=1, how="all").dropna(how="all")
+
+
 def fetch_all_stocks(start: str = START_DATE, end: str = END_DATE) -> dict[str, pd.DataFrame]:
     """
-    取得所有前十大科技股資料
+    取得所有前十大科技股資料，依 ticker 拆成個別 DataFrame
     :return: {ticker: DataFrame} 字典
     """
+    data = fetch_all_panel(start, end)
+    if data.empty or not isinstance(data.columns, pd.MultiIndex):
+        return {}
+
     result = {}
-    for ticker, name in TECH_STOCKS.items():
-        df = fetch_stock(ticker, start, end)
+    available = set(data.columns.get_level_values(0))
+    for ticker in TECH_STOCKS:
+        if ticker not in available:
+            continue
+        # 各檔交易日不同，合併後需去掉該檔全為 NaN 的日期
+        df = data[ticker].dropna(how="all")
         if not df.empty:
             result[ticker] = df
     return result
@@ -6,11 +6,11 @@
 看哪個在回測中更準確。
 """
 
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from dynamic_threshold import get_dynamic_threshold, compute_volatility_regime
+from dynamic_threshold import get_dynamic_threshold_vec, compute_volatility_regime
+from yf_cache import cached_download
 
 US_TICKER = "QQQ"
 TW_STOCKS = {
@@ -34,60 +34,64 @@ def fetch_data():
     end = datetime.now().strftime("%Y-%m-%d")
     # 需足夠歷史以計算 252 日波動率
     start = "2024-01-01"
-    us = yf.download(US_TICKER, start=start, end=end, progress=False, auto_adjust=True)
+    us = cached_download(US_TICKER, start=start, end=end, progress=False, auto_adjust=True)
     if isinstance(us.columns, pd.MultiIndex):
         us.columns = us.columns.get_level_values(0)
     return us
 
 
-def run_backtest_with_vol_window(us: pd.DataFrame, tw_ticker: str, vol_window: int, start_date: str = None) -> dict:
-    """使用指定波動率窗口回測單一標的"""
+def fetch_tw(tw_ticker: str, start_date: str = None) -> pd.DataFrame:
+    """取得台股資料；三種窗口與實驗 A/B 會重複取同一檔，經快取只下載一次"""
     sd = start_date or START_DATE
-    tw = yf.download(tw_ticker, start=sd, end=datetime.now().strftime("%Y-%m-%d"), progress=False, auto_adjust=True)
+    tw = cached_download(tw_ticker, start=sd, end=datetime.now().strftime("%Y-%m-%d"), progress=False, auto_adjust=True)
     if isinstance(tw.columns, pd.MultiIndex):
         tw.columns = tw.columns.get_level_values(0)
+    return tw
+
+
+def run_backtest_with_vol_window(us: pd.DataFrame, tw_ticker: str, vol_window: int, start_date: str = None) -> dict:
+    """使用指定波動率窗口回測單一標的"""
+    tw = fetch_tw(tw_ticker, start_date)
     if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
         return None
 
     us = us[["Close"]].copy()
     us["us_ret"] = us["Close"].pct_change()
-    vol_series = compute_volatility_regime(us["us_ret"], window=vol_window)
+    us["vol"] = compute_volatility_regime(us["us_ret"], window=vol_window)
 
-    tw = tw[["Open", "High", "Close"]]
+    # 美股、台股各 reindex 一次到共同交易日，之後只用 ndarray，整段以陣列運算取代逐日 .loc
     common = us.index.intersection(tw.index).sort_values()
-    crash_list, surge_list = [], []
-
-    for i in range(1, len(common) - 2):
-        prev_d = common[i - 1]
-        d = common[i]
-        us_ret = us.loc[prev_d, "us_ret"] if prev_d in us.index else np.nan
-        if np.isnan(us_ret):
-            continue
-
-        vol = vol_series.loc[prev_d] if prev_d in vol_series.index else np.nan
-        th_c, th_s = get_dynamic_threshold(vol)
-
-        buy = tw.loc[d, "Open"]
-        d1, d2, d3 = common[i], common[i + 1], common[i + 2]
-        high_3d = max(tw.loc[d1, "High"], tw.loc[d2, "High"], tw.loc[d3, "High"])
-        ret_3d = (tw.loc[d3, "Close"] / buy - 1) * 100
-
-        us_ret_pct = us_ret * 100
-        if us_ret_pct < th_c:
-            crash_list.append({"win": high_3d > buy, "ret": ret_3d})
-        elif us_ret_pct > th_s:
-            surge_list.append({"win": high_3d > buy, "ret": ret_3d})
-
-    def stats(lst):
-        if not lst:
+    us = us.reindex(common)
+    us_ret = us["us_ret"].to_numpy(dtype=np.float64)
+    vol = us["vol"].to_numpy(dtype=np.float64)
+    tw = tw[["Open", "High", "Close"]].reindex(common)
+    open_ = tw["Open"].to_numpy(dtype=np.float64)
+    high = tw["High"].to_numpy(dtype=np.float64)
+    close = tw["Close"].to_numpy(dtype=np.float64)
+
+    # 第 i 天（1..n-3）進場：看前一日美股報酬，持有 i..i+2 三天
+    m = max(len(common) - 3, 0)
+    th_c, th_s = get_dynamic_threshold_vec(vol[:m])
+    prev_ret = us_ret[:m] * 100
+    buy = open_[1:m + 1]
+    high_3d = np.maximum.reduce([high[1:m + 1], high[2:m + 2], high[3:m + 3]])
+    ret_3d = (close[3:m + 3] / buy - 1) * 100
+    win = high_3d > buy
+
+    # NaN 報酬的比較皆為 False，與原本跳過缺值日相同
+    crash_mask = prev_ret < th_c
+    surge_mask = ~crash_mask & (prev_ret > th_s)
+
+    def stats(mask):
+        n = int(mask.sum())
+        if n == 0:
             return 0, 0, 0, 0
-        n = len(lst)
-        wins = sum(x["win"] for x in lst)
-        avg_ret = np.mean([x["ret"] for x in lst])
-        return n, wins, wins / n * 100 if n else 0, avg_ret
+        wins = int(win[mask].sum())
+        avg_ret = ret_3d[mask].mean()
+        return n, wins, wins / n * 100, avg_ret
 
-    c_n, c_w, c_wr, c_ret = stats(crash_list)
-    s_n, s_w, s_wr, s_ret = stats(surge_list)
+    c_n, c_w, c_wr, c_ret = stats(crash_mask)
+    s_n, s_w, s_wr, s_ret = stats(surge_mask)
 
     # 綜合準確度：加權勝率 + 加權報酬（事件數加權）
     total_events = c_n + s_n
@@ -106,6 +110,22 @@ def run_backtest_with_vol_window(us: pd.DataFrame, tw_ticker: str, vol_window: i
     }
 
 
+def run_grid(us: pd.DataFrame, start_date: str = None) -> dict:
+    """
+    依序回測 窗口 × 標的 的所有組合
+    每組只是毫秒級的向量化運算（台股資料由快取讀取），開多程序並傳送 us 的成本反而更高
+    :return: {窗口名稱: [各標的結果 dict]}
+    """
+    results = {name: [] for name in VOL_WINDOWS}
+    for win_name, win_days in VOL_WINDOWS.items():
+        for ticker, name in TW_STOCKS.items():
+            r = run_backtest_with_vol_window(us, ticker, win_days, start_date)
+            if r:
+                r["stock"] = name
+                results[win_name].append(r)
+    return results
+
+
 def main():
     print("=" * 70)
     print("實驗：波動率窗口對動態門檻準確度的影響")
@@ -121,15 +141,8 @@ def main():
     # 實驗 A：完整期間
     us = us_full
     print("\n【實驗 A】完整期間回測")
-    results_by_window = {name: [] for name in VOL_WINDOWS}
-
-    for win_name, win_days in VOL_WINDOWS.items():
-        print(f"  計算窗口 {win_name} ...")
-        for ticker, name in TW_STOCKS.items():
-            r = run_backtest_with_vol_window(us, ticker, win_days)
-            if r:
-                r["stock"] = name
-                results_by_window[win_name].append(r)
+    print(f"  計算窗口 {'、'.join(VOL_WINDOWS)} ...")
+    results_by_window = run_grid(us)
 
     # 彙總各窗口的整體表現
     print("\n" + "=" * 70)
@@ -175,12 +188,7 @@ def main():
     three_months_ago = (datetime.now() - timedelta(days=95)).strftime("%Y-%m-%d")
     if us_full.index.max() >= pd.Timestamp(three_months_ago):
         print(f"\n【實驗 B】僅最近 3 個月回測（{three_months_ago} 至今）")
-        results_b = {name: [] for name in VOL_WINDOWS}
-        for win_name, win_days in VOL_WINDOWS.items():
-            for ticker, name in TW_STOCKS.items():
-                r = run_backtest_with_vol_window(us_full, ticker, win_days, start_date=three_months_ago)
-                if r:
-                    results_b[win_name].append(r)
+        results_b = run_grid(us_full, start_date=three_months_ago)
 
         summary_b = []
         for win_name, ress in list(results_b.items()):
@@ -5,30 +5,37 @@
 預測 → 驗證 → 輸出結果圖
 """
 
+import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-
-# 設定中文字體（Windows 微軟正黑體、雅黑體；若無則嘗試其他）
-plt.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei", "SimSun"]
-plt.rcParams["axes.unicode_minus"] = False
+from typing import Optional
 from data_fetcher import fetch_stock
 from indicators import add_all_indicators
-from model import create_sequences, train_lstm, predict_lstm
-from sklearn.preprocessing import StandardScaler
+from model import create_sequences, train_lstm, predict_lstm, export_int8
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from config import TECH_STOCKS, START_DATE, END_DATE
 
+# 繪圖時每條線最多的點數，超過則等間隔抽樣（驗證指標仍使用完整資料）
+MAX_PLOT_POINTS = 2000
+
 
-def run_prediction_and_plot(ticker: str = "2330.TW", seq_len: int = 60) -> None:
+def run_prediction_and_plot(
+    ticker: str = "2330.TW",
+    seq_len: int = 60,
+    plot: bool = True,
+    export_path: Optional[str] = None
+) -> Optional[dict]:
     """
     執行預測、驗證，並輸出結果圖
+    :param plot: False 時不繪圖（排程 / 無螢幕環境），也不會載入 matplotlib
+    :param export_path: 指定時將訓練好的模型量化為 int8 存檔，供樹莓派推論
+    :return: 驗證指標 {"mae", "rmse", "direction_acc"}；無資料時回傳 None
     """
     print(f"下載 {ticker} ({TECH_STOCKS.get(ticker, ticker)}) 資料...")
     df = fetch_stock(ticker, START_DATE, END_DATE)
     if df.empty:
         print(f"無法取得 {ticker} 資料")
-        return
+        return None
 
     print("計算技術指標...")
     df = add_all_indicators(df)
@@ -39,10 +46,15 @@ def run_prediction_and_plot(ticker: str = "2330.TW", seq_len: int = 60) -> None:
         "ATR_14", "SMA_20", "EMA_12", "OBV"
     ]
     available = [c for c in feature_cols if c in df.columns]
-    data = df[available].values
-
-    scaler = StandardScaler()
-    data_scaled = scaler.fit_transform(data)
+    data = df[available].to_numpy(dtype=np.float64, copy=True)  # 下方原地標準化需可寫入的獨立陣列
+
+    # 標準化（與 StandardScaler 相同：母體標準差，常數欄位除以 1），直接原地改寫 data 不另配置陣列
+    mean = data.mean(axis=0)
+    std = data.std(axis=0, ddof=0)
+    std[std == 0] = 1.0
+    data_scaled = data
+    data_scaled -= mean
+    data_scaled /= std
     target_col_idx = available.index("Close")
 
     X, y = create_sequences(data_scaled, target_col_idx, seq_len=seq_len)
@@ -54,18 +66,24 @@ def run_prediction_and_plot(ticker: str = "2330.TW", seq_len: int = 60) -> None:
     model = train_lstm(X_train, y_train, input_size=len(available), epochs=100)
 
     pred = predict_lstm(model, X)
-    pred_matrix = np.zeros((len(pred), len(available)))
-    pred_matrix[:, target_col_idx] = pred
-    pred_orig = scaler.inverse_transform(pred_matrix)[:, target_col_idx]
-
-    y_matrix = np.zeros((len(y), len(available)))
-    y_matrix[:, target_col_idx] = y
-    y_orig = scaler.inverse_transform(y_matrix)[:, target_col_idx]
+    if export_path:
+        export_int8(model, export_path, meta={
+            "ticker": ticker, "seq_len": seq_len, "feature_cols": available,
+            "mean": mean.tolist(), "std": std.tolist(), "target_col_idx": target_col_idx,
+        })
+    # 反標準化即 x * std + mean，只需收盤價欄位的兩個純量
+    close_mean = mean[target_col_idx]
+    close_scale = std[target_col_idx]
+    pred_orig = pred * close_scale + close_mean
+    y_orig = y * close_scale + close_mean
 
     # 驗證指標
     mae = mean_absolute_error(y_orig, pred_orig)
     rmse = np.sqrt(mean_squared_error(y_orig, pred_orig))
-    direction_acc = np.mean((np.diff(y_orig) > 0) == (np.diff(pred_orig) > 0))
+    # 同向（乘積 > 0）即方向正確；實際收盤持平的日子不算預測正確
+    diff_y = np.diff(y_orig)
+    diff_p = np.diff(pred_orig)
+    direction_acc = np.mean((diff_y * diff_p) > 0)
 
     print("\n========== 驗證結果 ==========")
     print(f"MAE (平均絕對誤差): {mae:.2f}")
@@ -73,26 +91,52 @@ def run_prediction_and_plot(ticker: str = "2330.TW", seq_len: int = 60) -> None:
     print(f"方向準確率 (漲跌預測): {direction_acc*100:.1f}%")
     print("==============================\n")
 
-    # 繪圖：對齊日期（y 對應 data[seq_len:] 的每一天）
-    dates = df.index[seq_len : seq_len + len(pred_orig)]
+    if plot:
+        # 繪圖：對齊日期（y 對應 data[seq_len:] 的每一天）
+        dates = df.index[seq_len : seq_len + len(pred_orig)]
+        plot_result(ticker, dates, y_orig, pred_orig, split)
+
+    return {"mae": float(mae), "rmse": float(rmse), "direction_acc": float(direction_acc)}
+
+
+def plot_result(ticker: str, dates: pd.Index, y_orig: np.ndarray, pred_orig: np.ndarray, train_end: int) -> None:
+    """
+    輸出預測 vs 實際、訓練 / 測試區間的結果圖
+    matplotlib 在這裡才載入，不繪圖時不需付出載入成本
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+    # 設定中文字體（Windows 微軟正黑體、雅黑體；若無則嘗試其他）
+    plt.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei", "SimSun"]
+    plt.rcParams["axes.unicode_minus"] = False
+    # 長序列折線分段繪製，降低 Agg 路徑處理成本
+    plt.rcParams["agg.path.chunksize"] = 10000
+
+    # 長序列只抽樣繪圖；訓練 / 測試各自從區間起點抽樣，分界點不會被略過
+    step = max(1, len(dates) // MAX_PLOT_POINTS)
+    tr, te = slice(0, train_end, step), slice(train_end, None, step)
 
     fig, axes = plt.subplots(2, 1, figsize=(12, 8), sharex=True)
 
     # 圖1：實際 vs 預測
     ax1 = axes[0]
-    ax1.plot(dates, y_orig, label="實際收盤價", color="#2E86AB", linewidth=1.5)
-    ax1.plot(dates, pred_orig, label="LSTM 預測", color="#E94F37", linewidth=1.5, alpha=0.8)
+    ax1.plot(dates[::step], y_orig[::step], label="實際收盤價", color="#2E86AB", linewidth=1.5, rasterized=True)
+    ax1.plot(dates[::step], pred_orig[::step], label="LSTM 預測", color="#E94F37", linewidth=1.5, alpha=0.8, rasterized=True)
+    # 共用 x 軸：精簡日期刻度（年 / 月只在變動時標示）
+    locator = AutoDateLocator()
+    ax1.xaxis.set_major_locator(locator)
+    ax1.xaxis.set_major_formatter(ConciseDateFormatter(locator))
     ax1.set_ylabel("價格")
     ax1.set_title(f"{TECH_STOCKS.get(ticker, ticker)} ({ticker}) - 預測 vs 實際")
     ax1.legend(loc="upper left")
     ax1.grid(True, alpha=0.3)
 
     # 圖2：訓練 / 測試區間
-    train_end = split
     ax2 = axes[1]
-    ax2.plot(dates[:train_end], y_orig[:train_end], color="#2E86AB", label="訓練集", linewidth=1)
-    ax2.plot(dates[train_end:], y_orig[train_end:], color="#28A745", label="測試集（驗證）", linewidth=1)
-    ax2.plot(dates[train_end:], pred_orig[train_end:], color="#E94F37", label="測試集預測", linewidth=1, alpha=0.8, linestyle="--")
+    ax2.plot(dates[tr], y_orig[tr], color="#2E86AB", label="訓練集", linewidth=1, rasterized=True)
+    ax2.plot(dates[te], y_orig[te], color="#28A745", label="測試集（驗證）", linewidth=1, rasterized=True)
+    ax2.plot(dates[te], pred_orig[te], color="#E94F37", label="測試集預測", linewidth=1, alpha=0.8, linestyle="--", rasterized=True)
     ax2.axvline(x=dates[train_end], color="gray", linestyle=":", alpha=0.7)
     ax2.set_ylabel("價格")
     ax2.set_xlabel("日期")
@@ -108,4 +152,9 @@ def run_prediction_and_plot(ticker: str = "2330.TW", seq_len: int = 60) -> None:
 
 
 if __name__ == "__main__":
-    run_prediction_and_plot("2330.TW")
+    parser = argparse.ArgumentParser(description="台股 LSTM 預測與驗證")
+    parser.add_argument("ticker", nargs="?", default="2330.TW", help="股票代號（預設 2330.TW）")
+    parser.add_argument("--no-plot", action="store_true", help="不繪圖，只輸出驗證指標（排程 / 無螢幕環境）")
+    parser.add_argument("--export-int8", metavar="PATH", help="將模型量化為 int8 存檔（如 lstm_int8.pt），供樹莓派推論")
+    args = parser.parse_args()
+    run_prediction_and_plot(args.ticker, plot=not args.no_plot, export_path=args.export_int8)
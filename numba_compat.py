@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Numba 相容層
+============
+有安裝 numba 時提供 njit / prange 編譯加速；
+未安裝時（如樹莓派精簡環境）退回一般 Python 函式，結果相同只是較慢。
+"""
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """未安裝 numba 時的替代裝飾器：原樣回傳函式"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
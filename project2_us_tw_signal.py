@@ -7,10 +7,10 @@
 3. 輸出建議：台股有機會漲的機率
 """
 
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from yf_cache import cached_download
 
 # 與台股科技高度相關的美股（供應鏈、半導體、科技龍頭）
 # 美股收盤早於台股，可作為領先指標
@@ -24,6 +24,9 @@ US_TECH_STOCKS = {
     "SMH": "半導體ETF",
 }
 
+# 計算台股上漲機率時各美股的權重（與台股相關性越高越重）；未列出者 0.05
+US_WEIGHTS = {"TSM": 0.25, "NVDA": 0.20, "QQQ": 0.18, "AAPL": 0.15, "AMD": 0.12, "MSFT": 0.06, "SMH": 0.04}
+
 # 對應的台股科技股
 TW_TECH_NAMES = "台積電、鴻海、聯發科、聯電、台達電、廣達、日月光、大立光、緯穎、瑞昱"
 
@@ -35,12 +38,24 @@ def fetch_us_tech_returns(lookback_days: int = 5) -> pd.DataFrame:
     start_str = start.strftime("%Y-%m-%d")
     end_str = end.strftime("%Y-%m-%d")
 
+    # 所有美股一次下載（單一 multi-ticker 請求），再依代碼切出各自的資料
+    try:
+        all_data = cached_download(
+            " ".join(US_TECH_STOCKS),
+            start=start_str,
+            end=end_str,
+            progress=False,
+            auto_adjust=True,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception:
+        all_data = pd.DataFrame()
+
     result = {}
     for ticker, name in US_TECH_STOCKS.items():
         try:
-            data = yf.download(ticker, start=start_str, end=end_str, progress=False, auto_adjust=True)
-            if isinstance(data.columns, pd.MultiIndex):
-                data.columns = data.columns.get_level_values(0)
+            data = all_data[ticker].dropna(how="all")
             if not data.empty and "Close" in data.columns and len(data) >= 2:
                 ret_1d = data["Close"].pct_change().iloc[-1] * 100
                 ret_5d = (data["Close"].iloc[-1] / data["Close"].iloc[-min(lookback_days + 1, len(data))] - 1) * 100 if len(data) > lookback_days else np.nan
@@ -62,16 +77,12 @@ def calc_taiwan_rise_probability(us_df: pd.DataFrame) -> float:
     if valid.empty:
         return 0.5
 
-    weights = {"TSM": 0.25, "NVDA": 0.20, "QQQ": 0.18, "AAPL": 0.15, "AMD": 0.12, "MSFT": 0.06, "SMH": 0.04}
-    score = 0
-    total_weight = 0
-    for ticker, row in valid.iterrows():
-        w = weights.get(ticker, 0.05)
-        s = 1 if row["ret_1d_pct"] > 0 else (-1 if row["ret_1d_pct"] < 0 else 0)
-        if not np.isnan(row.get("ret_5d_pct", np.nan)) and row["ret_5d_pct"] > 0:
-            s += 0.5
-        score += s * w
-        total_weight += w
+    w_arr = valid.index.map(US_WEIGHTS).fillna(0.05).to_numpy(dtype=float)
+    ret1 = valid["ret_1d_pct"].to_numpy(dtype=float)
+    ret5 = valid["ret_5d_pct"].to_numpy(dtype=float) if "ret_5d_pct" in valid.columns else np.full(len(valid), np.nan)
+    s = np.sign(ret1) + 0.5 * (ret5 > 0)  # NaN > 0 為 False，不加分
+    score = float(np.dot(s, w_arr))
+    total_weight = float(w_arr.sum())
 
     if total_weight == 0:
         return 0.5
@@ -9,15 +9,15 @@
 勝率定義：隔天開盤買入後，三天內有漲（最高價曾超過買入價）
 """
 
-import yfinance as yf
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 import os
-
-plt.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei"]
-plt.rcParams["axes.unicode_minus"] = False
+from yf_cache import cached_download
+from table_image import save_table_image
+from backtest_kernels import label_hold
 
 US_TICKER = "QQQ"
 # 台達電、旺宏、聯電、廣達、鴻海
@@ -34,65 +34,73 @@ THRESHOLD_CRASH = -1.0
 THRESHOLD_SURGE = 1.0
 
 
-def fetch_us_data():
-    end = datetime.now().strftime("%Y-%m-%d")
-    us = yf.download(US_TICKER, start=START_DATE, end=end, progress=False, auto_adjust=True)
-    if isinstance(us.columns, pd.MultiIndex):
-        us.columns = us.columns.get_level_values(0)
-    return us
-
-
-def fetch_tw_data(ticker: str):
+def fetch_all_data() -> dict:
+    """
+    一次下載美股 QQQ 與所有台股標的（單一 multi-ticker 請求）
+    :return: {ticker: DataFrame}
+    """
     end = datetime.now().strftime("%Y-%m-%d")
-    tw = yf.download(ticker, start=START_DATE, end=end, progress=False, auto_adjust=True)
-    if isinstance(tw.columns, pd.MultiIndex):
-        tw.columns = tw.columns.get_level_values(0)
-    return tw
+    tickers = [US_TICKER] + list(TW_STOCKS)
+    data = cached_download(
+        " ".join(tickers),
+        start=START_DATE,
+        end=end,
+        progress=False,
+        auto_adjust=True,
+        group_by="ticker",
+        threads=True,
+    )
+    result = {}
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.get_level_values(0):
+            # 美股、台股交易日不同，合併後需去掉該標的全為 NaN 的日期
+            result[ticker] = data[ticker].dropna(how="all")
+        else:
+            result[ticker] = pd.DataFrame()
+    return result
 
 
-def align_and_label(us: pd.DataFrame, tw: pd.DataFrame) -> pd.DataFrame:
+def prepare_us(us: pd.DataFrame) -> pd.DataFrame:
     """
-    隔天開盤買入，三天內有漲（最高價曾超過買入價）即為獲利
+    美股日報酬只與 QQQ 有關，於 run() 計算一次後供所有台股標的共用
+    :return: 含 Close, us_ret（小數）的 DataFrame
     """
     us = us[["Close"]].copy()
     us["us_ret"] = us["Close"].pct_change()
+    return us
+
 
-    tw = tw[["Open", "High", "Close"]].copy()
-    common = us.index.intersection(tw.index).sort_values()
-    result = []
-    for i, d in enumerate(common):
-        if i == 0 or i + 2 >= len(common):  # 需有往後 3 個交易日
-            continue
-        prev_d = common[i - 1]
-        us_prev_ret = us.loc[prev_d, "us_ret"] if prev_d in us.index else np.nan
-        if np.isnan(us_prev_ret):
-            continue
-        buy_price = tw.loc[d, "Open"]
-        # 買入後 3 天內的最高價
-        d1, d2, d3 = common[i], common[i + 1], common[i + 2]
-        high_3d = max(
-            tw.loc[d1, "High"] if d1 in tw.index else 0,
-            tw.loc[d2, "High"] if d2 in tw.index else 0,
-            tw.loc[d3, "High"] if d3 in tw.index else 0,
-        )
-        win = high_3d > buy_price
-        ret_3d = (tw.loc[d3, "Close"] / buy_price - 1) * 100  # 持有 3 天報酬
-        result.append({
-            "date": d,
-            "us_prev_ret": us_prev_ret * 100,
-            "win": win,
-            "ret_3d": ret_3d,
-            "is_crash": us_prev_ret < THRESHOLD_CRASH / 100,
-            "is_surge": us_prev_ret > THRESHOLD_SURGE / 100,
-        })
-    return pd.DataFrame(result)
-
-
-def run_single(ticker: str, name: str, us: pd.DataFrame) -> dict:
-    tw = fetch_tw_data(ticker)
+def align_and_label(us_enriched: pd.DataFrame, tw: pd.DataFrame) -> pd.DataFrame:
+    """
+    隔天開盤買入，三天內有漲（最高價曾超過買入價）即為獲利
+    :param us_enriched: prepare_us() 的結果
+    """
+    # 以共同交易日 inner join，之後改用 numpy 陣列的位置索引計算
+    merged = us_enriched[["us_ret"]].join(tw[["Open", "High", "Close"]], how="inner").sort_index()
+    us_ret = merged["us_ret"].to_numpy(dtype=np.float64)
+    buy_idx, win, ret_3d = label_hold(
+        merged["Open"].to_numpy(dtype=np.float64),
+        merged["High"].to_numpy(dtype=np.float64),
+        merged["Close"].to_numpy(dtype=np.float64),
+        us_ret,
+        hold_days=3,  # 買入後 3 天（i..i+2）
+        n_forward=2,
+    )
+    us_prev = us_ret[buy_idx - 1]  # 買入日前一個共同交易日的美股報酬
+    return pd.DataFrame({
+        "date": merged.index[buy_idx],
+        "us_prev_ret": us_prev * 100,
+        "win": win,
+        "ret_3d": ret_3d,  # 持有 3 天報酬
+        "is_crash": us_prev < THRESHOLD_CRASH / 100,
+        "is_surge": us_prev > THRESHOLD_SURGE / 100,
+    })
+
+
+def run_single(ticker: str, name: str, us_enriched: pd.DataFrame, tw: pd.DataFrame) -> dict:
     if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
         return None
-    df = align_and_label(us, tw)
+    df = align_and_label(us_enriched, tw)
     if df.empty:
         return None
     crash_days = df[df["is_crash"]]
@@ -129,23 +137,9 @@ def save_chart(results: list) -> None:
             r["name"], str(r["crash_n"]), str(r["crash_wins"]), f"{r['crash_wr']:.1f}", f"{r['crash_avg']:+.2f}",
             str(r["surge_n"]), str(r["surge_wins"]), f"{r['surge_wr']:.1f}", f"{r['surge_avg']:+.2f}", better
         ])
-    fig, ax = plt.subplots(figsize=(14, len(results) * 0.5 + 2))
-    ax.axis("off")
-    table = ax.table(
-        cellText=data,
-        colLabels=cols,
-        loc="center",
-        cellLoc="center",
-        colColours=["#4472C4"] * 10,
-    )
-    table.auto_set_font_size(False)
-    table.set_fontsize(10)
-    table.scale(1, 2)
-    plt.title(f"美股大跌 vs 美股大漲後隔天買台股（{START_DATE} 至今）\n策略：隔天開盤買，3日內有漲即獲利", fontsize=12)
-    plt.tight_layout()
+    title = f"美股大跌 vs 美股大漲後隔天買台股（{START_DATE} 至今）\n策略：隔天開盤買，3日內有漲即獲利"
     out_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backtest_result.png")
-    plt.savefig(out_path, dpi=150)
-    plt.close()
+    save_table_image(cols, data, title, out_path)
     print(f"\n圖表已儲存至: {out_path}")
 
 
@@ -170,7 +164,11 @@ def print_recommendations(results: list) -> None:
     print("=" * 60)
 
 
-def run() -> None:
+def run(plot: bool = True) -> None:
+    """
+    執行所有標的回測並輸出彙總表與操作建議
+    :param plot: False 時不輸出結果表圖片（排程 / 無螢幕環境）
+    """
     print("=" * 60)
     print("對比回測：美股大跌 vs 美股大漲後隔天買台股")
     print("=" * 60)
@@ -179,16 +177,19 @@ def run() -> None:
     print(f"美股大漲：漲幅 > {THRESHOLD_SURGE}%")
     print("策略：隔天開盤買，持有 3 日內有漲（最高價超過買入價）即為獲利\n")
 
-    us = fetch_us_data()
+    data = fetch_all_data()
+    us = data[US_TICKER]
     if us.empty:
         print("無法取得美股資料")
         return
+    us_enriched = prepare_us(us)
 
-    results = []
-    for ticker, name in TW_STOCKS.items():
-        r = run_single(ticker, name, us)
-        if r:
-            results.append(r)
+    # 各標的互相獨立，以執行緒平行計算（pandas / numpy 運算會釋放 GIL）；map 保持原順序
+    with ThreadPoolExecutor(max_workers=min(8, len(TW_STOCKS))) as ex:
+        results = [
+            r for r in ex.map(lambda kv: run_single(kv[0], kv[1], us_enriched, data[kv[0]]), TW_STOCKS.items())
+            if r
+        ]
 
     # 彙總表格
     print("【彙總表格】")
@@ -205,11 +206,15 @@ def run() -> None:
     print("=" * 95)
 
     # 儲存圖表到本地
-    save_chart(results)
+    if plot:
+        save_chart(results)
 
     # 輸出操作建議
     print_recommendations(results)
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="美股大跌 vs 大漲後隔天買台股回測")
+    parser.add_argument("--no-plot", action="store_true", help="不輸出結果表圖片")
+    args = parser.parse_args()
+    run(plot=not args.no_plot)
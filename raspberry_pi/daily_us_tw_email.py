@@ -6,14 +6,12 @@
 """
 
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import yfinance as yf
+from email.message import EmailMessage
 import pandas as pd
 import os
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from dynamic_threshold import get_dynamic_threshold, compute_volatility_regime
+from dynamic_threshold import get_dynamic_threshold, build_us_context
 from strategy_stats import (
     fetch_and_backtest,
     fetch_and_backtest_6m,
@@ -37,29 +35,27 @@ US_TICKER = "QQQ"
 
 # 大跌/大漲建議改由第五項+第六項回測綜合結果動態產生（見 get_combined_recommendation）
 
+# 信件分隔線與結尾免責聲明
+SEP = "=" * 55
+SEP2 = "-" * 55
+FOOTER = (SEP, "※ 此建議僅供參考，不構成投資建議，請自行評估風險。", SEP)
 
-def get_us_report() -> dict:
+TZ_TW = ZoneInfo("Asia/Taipei")
+TZ_US = ZoneInfo("America/New_York")
+
+
+def get_us_report(us_ctx: pd.DataFrame = None) -> dict:
     """
     每日流程：計算 20 日波動率 → 更新閥值 → 取得美股昨日表現
+    :param us_ctx: build_us_context 產生的美股資料；None 則自行下載近 35 日（需 20+ 日算波動率）
     """
-    end = datetime.now()
-    start = end - timedelta(days=35)  # 需 20+ 日算波動率
     try:
-        data = yf.download(
-            US_TICKER,
-            start=start.strftime("%Y-%m-%d"),
-            end=end.strftime("%Y-%m-%d"),
-            progress=False,
-            auto_adjust=True
-        )
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = data.columns.get_level_values(0)
+        data = us_ctx if us_ctx is not None else build_us_context(US_TICKER, days=35)
         if data.empty or len(data) < 2:
             return None
 
-        # Step 1: 計算 20 日波動率
-        ret = data["Close"].pct_change()
-        vol_series = compute_volatility_regime(ret, window=20)
+        # Step 1: 20 日波動率（build_us_context 已算好）
+        vol_series = data["vol_20d"]
         vol_20d = vol_series.iloc[-2] if len(vol_series) >= 2 and not pd.isna(vol_series.iloc[-2]) else 1.0
 
         # Step 2: 依波動率更新閥值
@@ -102,74 +98,30 @@ def _build_integrated_recommendations(
     crash_top50_10d: list,
     surge_top50_10d: list,
     top50_results_10d: list,
-) -> str:
+) -> list[str]:
     """
     整合第四項與第八項，分別呈現短期（3日）與長期（10日）建議，並附報酬率
+    :return: 第九項的各行文字（由 build_email_content 併入信件）
     """
-    sep2 = "-" * 55
-
-    # 短期：建立 3 日報酬對照（strategy_stats 7 檔 + top50）
-    ret_3d = {}
-    if strategy_stats:
-        for name, s in strategy_stats.items():
-            ret_3d[name] = (s["crash_ret"], s["surge_ret"])
-    if top50_results:
-        for r in top50_results:
-            ret_3d[r["name"]] = (r["crash_ret"], r["surge_ret"])
-
-    # 短期大跌：合併 crash_3m + crash_top50，去重並附報酬
-    short_crash = []
-    seen = set()
-    for name in crash_3m + crash_top50:
-        if name in seen:
-            continue
-        seen.add(name)
-        if name in ret_3d:
-            r_val = ret_3d[name][0]
-            short_crash.append(f"{name} {r_val:+.2f}%")
-        else:
-            short_crash.append(name)
-
-    # 短期大漲：合併 surge_3m + surge_top50
-    short_surge = []
-    seen = set()
-    for name in surge_3m + surge_top50:
-        if name in seen:
-            continue
-        seen.add(name)
-        if name in ret_3d:
-            r_val = ret_3d[name][1]
-            short_surge.append(f"{name} {r_val:+.2f}%")
-        else:
-            short_surge.append(name)
-
-    # 長期：建立 10 日報酬對照
-    ret_10d = {}
-    if top50_results_10d:
-        for r in top50_results_10d:
-            ret_10d[r["name"]] = (r["crash_ret"], r["surge_ret"])
-
-    long_crash = []
-    for name in crash_top50_10d:
-        if name in ret_10d:
-            r_val = ret_10d[name][0]
-            long_crash.append(f"{name} {r_val:+.2f}%")
-        else:
-            long_crash.append(name)
-
-    long_surge = []
-    for name in surge_top50_10d:
-        if name in ret_10d:
-            r_val = ret_10d[name][1]
-            long_surge.append(f"{name} {r_val:+.2f}%")
-        else:
-            long_surge.append(name)
-
-    lines = [
-        "",
-        f"{sep2}",
+    def with_ret(names: list, ret_map: dict, idx: int) -> list[str]:
+        """依序去重（dict.fromkeys 保留先後），有報酬資料者附上報酬率"""
+        return [f"{n} {ret_map[n][idx]:+.2f}%" if n in ret_map else n for n in dict.fromkeys(names)]
+
+    # 短期：3 日報酬對照（strategy_stats 7 檔 + top50，後者同名時覆蓋）
+    ret_3d = {name: (s["crash_ret"], s["surge_ret"]) for name, s in (strategy_stats or {}).items()}
+    ret_3d.update({r["name"]: (r["crash_ret"], r["surge_ret"]) for r in top50_results or []})
+    # 長期：10 日報酬對照
+    ret_10d = {r["name"]: (r["crash_ret"], r["surge_ret"]) for r in top50_results_10d or []}
+
+    short_crash = with_ret(crash_3m + crash_top50, ret_3d, 0)
+    short_surge = with_ret(surge_3m + surge_top50, ret_3d, 1)
+    long_crash = with_ret(crash_top50_10d, ret_10d, 0)
+    long_surge = with_ret(surge_top50_10d, ret_10d, 1)
+
+    return [
+        SEP2,
         "九、短期與長期建議整合（第四項＋第八項，含報酬率）",
-        sep2,
+        SEP2,
         "  【短期】3 日持有，來自第四項（3 個月建議＋熱門 50 前 20 名）",
         f"  美股大跌後隔天買：{', '.join(short_crash) if short_crash else '無'}",
         f"  美股大漲後隔天買：{', '.join(short_surge) if short_surge else '無'}",
@@ -179,49 +131,50 @@ def _build_integrated_recommendations(
         f"  美股大漲後隔天買：{', '.join(long_surge) if long_surge else '無'}",
         "",
     ]
-    return "\n".join(lines)
 
 
 def build_email_content(
     report: dict,
-    strategy_stats: dict = None,
-    strategy_stats_6m: dict = None,
+    strategy_stats: dict,
+    strategy_stats_6m: dict,
     top50_results: list = None,
     top50_results_10d: list = None,
 ) -> str:
-    """組裝信件內容：閥值、波動率、美股漲跌、台股建議、歷史策略表、過去半年回測表、熱門台股篩選"""
-    sep = "=" * 55
-    sep2 = "-" * 55
-
-    now_tw = datetime.now(ZoneInfo("Asia/Taipei"))
-    now_us = now_tw.astimezone(ZoneInfo("America/New_York"))
+    """
+    組裝信件內容：閥值、波動率、美股漲跌、台股建議、歷史策略表、過去半年回測表、熱門台股篩選
+    回測結果由呼叫端傳入（fetch_and_backtest / fetch_and_backtest_6m），此處不會重新回測；
+    top50_results / top50_results_10d 為 None 時省略對應段落
+    """
+    now_tw = datetime.now(TZ_TW)
+    now_us = now_tw.astimezone(TZ_US)
     time_tw = now_tw.strftime("%Y-%m-%d %H:%M")
     ampm = "下午" if now_us.hour >= 12 else "上午"
     hour_12 = now_us.hour % 12 if now_us.hour % 12 else 12
     time_us_cn = f"{ampm} {hour_12}:{now_us.strftime('%M')}"
 
-    if not report:
-        return f"""{sep}
-  每日美股統整與台股操作建議
-{sep}
-
-報告產生時間：{time_tw}（台灣時間）= 美東 {time_us_cn}
-
-{sep2}
-【錯誤】無法取得美股資料，請稍後再試。
-建議：暫不操作，待資料更新後再執行腳本。
-{sep2}
+    # 各段落以行為單位收集，最後只 join 一次
+    parts = [
+        SEP,
+        "  每日美股統整與台股操作建議",
+        SEP,
+        "",
+        f"報告產生時間：{time_tw}（台灣時間）= 美東 {time_us_cn}",
+    ]
 
-{sep}
-※ 此建議僅供參考，不構成投資建議，請自行評估風險。
-{sep}"""
+    if not report:
+        parts.extend([
+            "",
+            SEP2,
+            "【錯誤】無法取得美股資料，請稍後再試。",
+            "建議：暫不操作，待資料更新後再執行腳本。",
+            SEP2,
+            "",
+            *FOOTER,
+        ])
+        return "\n".join(parts)
 
     r = report
 
-    if strategy_stats is None:
-        strategy_stats = fetch_and_backtest()
-    if strategy_stats_6m is None:
-        strategy_stats_6m = fetch_and_backtest_6m()
     flat_advice, flat_conclusion = get_flat_etf_recommendation(strategy_stats)
     crash_3m, surge_3m, crash_intersection, surge_intersection = get_combined_recommendation(
         strategy_stats, strategy_stats_6m
@@ -234,98 +187,138 @@ def build_email_content(
 
     if r["is_surge"]:
         action = "美股昨日大漲，建議隔天開盤可考慮買入："
-        primary = f"{', '.join(surge_3m)}（3 個月）" if surge_3m else "（無 3 個月建議標的）"
+        stocks = f"{', '.join(surge_3m)}（3 個月）" if surge_3m else "（無 3 個月建議標的）"
         intersection = ", ".join(surge_intersection) if surge_intersection else None
-        stocks = primary
-        stocks_extra = f"\n  交集建議（3 個月與半年皆建議）：{intersection}" if intersection else ""
     elif r["is_crash"]:
         action = "美股昨日大跌，建議隔天開盤可考慮買入："
-        primary = f"{', '.join(crash_3m)}（3 個月）" if crash_3m else "（無 3 個月建議標的）"
+        stocks = f"{', '.join(crash_3m)}（3 個月）" if crash_3m else "（無 3 個月建議標的）"
         intersection = ", ".join(crash_intersection) if crash_intersection else None
-        stocks = primary
-        stocks_extra = f"\n  交集建議（3 個月與半年皆建議）：{intersection}" if intersection else ""
     else:
         action = "美股昨日波動在閥值內（平盤）。"
         stocks = flat_advice
-        stocks_extra = ""
+        intersection = None
 
+    parts.extend([
+        f"  報價來源：{r.get('data_source', 'yfinance 即時抓取，為最近美股交易日收盤價')}",
+        "",
+        SEP2,
+        "一、20 日波動率（每日計算）",
+        SEP2,
+        f"  波動率：{r['vol_20d']:.2f}%",
+        "  說明：市場平靜時較低，暴風雨時較高",
+        "",
+        SEP2,
+        "二、今日閥值（依波動率動態更新）",
+        SEP2,
+        f"  大跌閥值：< {r['th_crash']:.1f}%",
+        f"  大漲閥值：> {r['th_surge']:.1f}%",
+        "  說明：波動率高時閥值較大，更穩健",
+        "",
+        SEP2,
+        "三、昨日美股收盤",
+        SEP2,
+        f"  日期：{r['date']}",
+        f"  QQQ 收盤：{r['close']:.2f}（即時抓取之最新收盤價）",
+        f"  漲跌幅：{r['chg_pct']:+.2f}%",
+        f"  判定：{r['status']}",
+        "",
+        SEP2,
+        "四、今日台股建議",
+        SEP2,
+        f"  {action}",
+        f"  → {stocks}",
+        "",
+    ])
+    if intersection:
+        parts.append(f"  交集建議（3 個月與半年皆建議）：{intersection}")
     # 第四項加入熱門 50 檔前 20 名建議
     if crash_top50 or surge_top50:
-        top50_block = "\n\n  【熱門 50 檔前 20 名】"
-        top50_block += f"\n  美股大跌後隔天買：{', '.join(crash_top50) if crash_top50 else '無'}"
-        top50_block += f"\n  美股大漲後隔天買：{', '.join(surge_top50) if surge_top50 else '無'}"
-        stocks_extra = (stocks_extra or "") + top50_block
+        parts.extend([
+            "",
+            "  【熱門 50 檔前 20 名】",
+            f"  美股大跌後隔天買：{', '.join(crash_top50) if crash_top50 else '無'}",
+            f"  美股大漲後隔天買：{', '.join(surge_top50) if surge_top50 else '無'}",
+        ])
+    parts.extend([
+        "",
+        "  說明：優先依 3 個月回測建議；交集為 3 個月與半年皆建議之標的；平盤依 0050/0052 歷史表現。",
+        "  策略：開盤買入，持有 3 日內若有漲可獲利了結。",
+        "",
+    ])
 
-    table_block = ""
+    # 各回測表的日期區間只算一次
+    now = datetime.now()
+    end_str = now.strftime("%Y-%m-%d")
+    start_3m = (now - timedelta(days=95)).strftime("%Y-%m-%d")
+    start_6m = (now - timedelta(days=185)).strftime("%Y-%m-%d")
     if strategy_stats:
-        start_3m = (datetime.now() - timedelta(days=95)).strftime("%Y-%m-%d")
-        end_3m = datetime.now().strftime("%Y-%m-%d")
-        table_block = f"""
-{sep2}
-五、歷史策略表（最近 3 個月回測：{start_3m} ~ {end_3m}）
-{sep2}
-  大跌買/大漲買/平盤買：次數、勝率%、均報酬%
-  （依動態門檻，持有 3 日內有漲即獲利）
-
-{get_strategy_table(strategy_stats)}
-
-  平盤時 ETF 建議：{flat_conclusion}
-"""
+        parts.extend([
+            SEP2,
+            f"五、歷史策略表（最近 3 個月回測：{start_3m} ~ {end_str}）",
+            SEP2,
+            "  大跌買/大漲買/平盤買：次數、勝率%、均報酬%",
+            "  （依動態門檻，持有 3 日內有漲即獲利）",
+            "",
+            get_strategy_table(strategy_stats),
+            "",
+            f"  平盤時 ETF 建議：{flat_conclusion}",
+            "",
+        ])
+    parts.append("")
 
-    table_block_6m = ""
     if strategy_stats_6m:
-        start_6m = (datetime.now() - timedelta(days=185)).strftime("%Y-%m-%d")
-        end_6m = datetime.now().strftime("%Y-%m-%d")
-        table_block_6m = f"""
-{sep2}
-六、過去半年歷史回測表（{start_6m} ~ {end_6m}）
-{sep2}
-  大跌買/大漲買/平盤買：次數、勝率%、均報酬%
-  （依動態門檻，持有 3 日內有漲即獲利）
-
-{get_strategy_table(strategy_stats_6m)}
-"""
+        parts.extend([
+            SEP2,
+            f"六、過去半年歷史回測表（{start_6m} ~ {end_str}）",
+            SEP2,
+            "  大跌買/大漲買/平盤買：次數、勝率%、均報酬%",
+            "  （依動態門檻，持有 3 日內有漲即獲利）",
+            "",
+            get_strategy_table(strategy_stats_6m),
+            "",
+        ])
+    parts.append("")
 
     # 第七項：熱門台股篩選（50 檔 → 前 20 名，crash_top50/surge_top50 已於上方計算）
-    table_block_top50 = ""
     if top50_results:
-        table_block_top50 = f"""
-{sep2}
-七、熱門台股篩選（50 檔 → 前 20 名，3 個月回測）
-{sep2}
-  篩選標的：50 檔熱門高交易量台股（台灣50成分股 + 熱門中小型）
-  排序依據：勝率 + 均報酬綜合評分
-
-{get_top20_table_text(top50_results)}
-
-  【前 20 名操作建議】
-  美股大跌後隔天買：{', '.join(crash_top50) if crash_top50 else '無'}
-  美股大漲後隔天買：{', '.join(surge_top50) if surge_top50 else '無'}
-"""
+        parts.extend([
+            SEP2,
+            "七、熱門台股篩選（50 檔 → 前 20 名，3 個月回測）",
+            SEP2,
+            "  篩選標的：50 檔熱門高交易量台股（台灣50成分股 + 熱門中小型）",
+            "  排序依據：勝率 + 均報酬綜合評分",
+            "",
+            get_top20_table_text(top50_results),
+            "",
+            "  【前 20 名操作建議】",
+            f"  美股大跌後隔天買：{', '.join(crash_top50) if crash_top50 else '無'}",
+            f"  美股大漲後隔天買：{', '.join(surge_top50) if surge_top50 else '無'}",
+            "",
+        ])
+    parts.append("")
 
     # 第八項：熱門 50 檔 10 日持有回測（50 選 20，半年），均報酬 >= 4% 才列入建議
-    table_block_10d = ""
     crash_top50_10d, surge_top50_10d = [], []
     if top50_results_10d:
         crash_top50_10d, surge_top50_10d = get_top20_recommendations_10d(top50_results_10d, min_ret=4.0)
-        start_6m = (datetime.now() - timedelta(days=185)).strftime("%Y-%m-%d")
-        end_6m = datetime.now().strftime("%Y-%m-%d")
-        table_block_10d = f"""
-{sep2}
-八、熱門 50 檔 10 日持有回測（50 選 20，半年：{start_6m} ~ {end_6m}）
-{sep2}
-  勝率%＝10日內有無漲；均報酬%＝持有至第10日收盤
-  建議門檻：均報酬 >= 4% 才列入
-
-{get_top20_table_text(top50_results_10d)}
-
-  【10 日持有操作建議】（均報酬 >= 4%）
-  美股大跌後隔天買：{', '.join(crash_top50_10d) if crash_top50_10d else '無'}
-  美股大漲後隔天買：{', '.join(surge_top50_10d) if surge_top50_10d else '無'}
-"""
+        parts.extend([
+            SEP2,
+            f"八、熱門 50 檔 10 日持有回測（50 選 20，半年：{start_6m} ~ {end_str}）",
+            SEP2,
+            "  勝率%＝10日內有無漲；均報酬%＝持有至第10日收盤",
+            "  建議門檻：均報酬 >= 4% 才列入",
+            "",
+            get_top20_table_text(top50_results_10d),
+            "",
+            "  【10 日持有操作建議】（均報酬 >= 4%）",
+            f"  美股大跌後隔天買：{', '.join(crash_top50_10d) if crash_top50_10d else '無'}",
+            f"  美股大漲後隔天買：{', '.join(surge_top50_10d) if surge_top50_10d else '無'}",
+            "",
+        ])
+    parts.append("")
 
     # 第九項：整合第四項與第八項，分別呈現短期與長期，並附報酬率
-    table_block_9 = _build_integrated_recommendations(
+    parts.extend(_build_integrated_recommendations(
         strategy_stats=strategy_stats,
         crash_3m=crash_3m,
         surge_3m=surge_3m,
@@ -337,59 +330,71 @@ def build_email_content(
         crash_top50_10d=crash_top50_10d,
         surge_top50_10d=surge_top50_10d,
         top50_results_10d=top50_results_10d,
-    )
+    ))
+    parts.append("")
+
+    parts.extend(FOOTER)
+    return "\n".join(parts)
+
+
+class SMTPPool:
+    """
+    Gmail SMTP 連線：同一次執行內共用一條已登入的連線（EHLO + STARTTLS + AUTH 只做一次）
+    第一次寄信時才連線，僅預覽時不會連線；寄信前以 NOOP 檢查連線，斷線則重新連線
+    用法：with SMTPPool() as pool: send_email(content, pool=pool)
+    """
+
+    def __init__(self, host: str = "smtp.gmail.com", port: int = 587, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.smtp = None
+
+    def __enter__(self) -> "SMTPPool":
+        return self
 
-    body = f"""{sep}
-  每日美股統整與台股操作建議
-{sep}
-
-報告產生時間：{time_tw}（台灣時間）= 美東 {time_us_cn}
-  報價來源：{r.get('data_source', 'yfinance 即時抓取，為最近美股交易日收盤價')}
-
-{sep2}
-一、20 日波動率（每日計算）
-{sep2}
-  波動率：{r['vol_20d']:.2f}%
-  說明：市場平靜時較低，暴風雨時較高
-
-{sep2}
-二、今日閥值（依波動率動態更新）
-{sep2}
-  大跌閥值：< {r['th_crash']:.1f}%
-  大漲閥值：> {r['th_surge']:.1f}%
-  說明：波動率高時閥值較大，更穩健
-
-{sep2}
-三、昨日美股收盤
-{sep2}
-  日期：{r['date']}
-  QQQ 收盤：{r['close']:.2f}（即時抓取之最新收盤價）
-  漲跌幅：{r['chg_pct']:+.2f}%
-  判定：{r['status']}
-
-{sep2}
-四、今日台股建議
-{sep2}
-  {action}
-  → {stocks}
-{stocks_extra}
-
-  說明：優先依 3 個月回測建議；交集為 3 個月與半年皆建議之標的；平盤依 0050/0052 歷史表現。
-  策略：開盤買入，持有 3 日內若有漲可獲利了結。
-{table_block}
-{table_block_6m}
-{table_block_top50}
-{table_block_10d}
-{table_block_9}
-
-{sep}
-※ 此建議僅供參考，不構成投資建議，請自行評估風險。
-{sep}"""
-    return body.strip()
-
-
-def send_email(content: str, preview: bool = False) -> bool:
-    """寄送信件（preview=True 時僅預覽不寄出）"""
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _connect(self) -> None:
+        self.close()
+        self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.smtp.ehlo()  # 驗證 SMTP 伺服器
+        self.smtp.starttls()  # 建立加密傳輸
+        self.smtp.login(GMAIL_SENDER, GMAIL_APP_PASSWORD)  # 登入寄件者 Gmail
+
+    def _alive(self) -> bool:
+        if self.smtp is None:
+            return False
+        try:
+            return self.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg) -> None:
+        """寄送郵件；連線已失效時重新連線後再寄"""
+        if not self._alive():
+            self._connect()
+        try:
+            self.smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._connect()
+            self.smtp.send_message(msg)
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+
+def send_email(content: str, preview: bool = False, pool: SMTPPool = None) -> bool:
+    """
+    寄送信件（preview=True 時僅預覽不寄出）
+    :param pool: 共用的 SMTPPool；None 時本次寄信自行連線、寄完即關閉
+    """
     if preview:
         print("【預覽】將寄出的信件內容：")
         print("=" * 50)
@@ -399,17 +404,18 @@ def send_email(content: str, preview: bool = False) -> bool:
         return True
 
     try:
-        msg = MIMEMultipart()
+        # 單一 text/plain 內文直接放進 EmailMessage，不再包一層 multipart 與 MIMEText 副本
+        msg = EmailMessage()
         msg["From"] = GMAIL_SENDER
         msg["To"] = RECIPIENT
         msg["Subject"] = f"【每日美股統整】{datetime.now().strftime('%Y-%m-%d')} 台股操作建議"
-        msg.attach(MIMEText(content, "plain", "utf-8"))
+        msg.set_content(content, charset="utf-8", cte="base64")
 
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.ehlo()  # 驗證 SMTP 伺服器
-            smtp.starttls()  # 建立加密傳輸
-            smtp.login(GMAIL_SENDER, GMAIL_APP_PASSWORD)  # 登入寄件者 Gmail
-            smtp.send_message(msg)  # 寄送郵件
+        if pool is None:
+            with SMTPPool() as own_pool:
+                own_pool.send(msg)
+        else:
+            pool.send(msg)  # 寄送郵件
 
         print("信件已成功寄出至", RECIPIENT)
         return True
@@ -419,9 +425,13 @@ def send_email(content: str, preview: bool = False) -> bool:
 
 
 if __name__ == "__main__":
-    import sys
-    preview_only = "--preview" in sys.argv or "-p" in sys.argv
-    auto_send = "--send" in sys.argv
+    import argparse
+
+    parser = argparse.ArgumentParser(description="每日美股統整與台股建議")
+    parser.add_argument("-p", "--preview", action="store_true", help="僅預覽，不寄出")
+    parser.add_argument("--send", action="store_true", help="直接寄出（不詢問）")
+    parser.add_argument("-v", "--verbose", action="store_true", help="--send 時也印出完整信件內容")
+    args = parser.parse_args()
 
     # 每日流程：20日波動率 → 更新閥值 → 歷史策略表 → 產生報告
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -429,13 +439,15 @@ if __name__ == "__main__":
     os.makedirs(stock_dir, exist_ok=True)
     today = datetime.now().strftime("%Y-%m-%d")
 
-    report = get_us_report()
-    strategy_stats = fetch_and_backtest()
-    strategy_stats_6m = fetch_and_backtest_6m()
+    # QQQ、波動率與門檻只下載／計算一次，各回測與篩選共用
+    us_ctx = build_us_context(US_TICKER)
+    report = get_us_report(us_ctx)
+    strategy_stats = fetch_and_backtest(us_ctx)
+    strategy_stats_6m = fetch_and_backtest_6m(us_ctx)
     print("\n[執行] 熱門台股篩選（50 檔，3 日）...")
-    top50_results = run_screening()
+    top50_results = run_screening(us_ctx)
     print("\n[執行] 熱門台股篩選（50 檔，10 日）...")
-    top50_results_10d = run_screening_10d()
+    top50_results_10d = run_screening_10d(us_ctx)
     content = build_email_content(
         report,
         strategy_stats,
@@ -443,7 +455,9 @@ if __name__ == "__main__":
         top50_results=top50_results,
         top50_results_10d=top50_results_10d,
     )
-    send_email(content, preview=True)
+    # 預覽與互動模式需要看內容；排程 --send 時內容已存檔，不再整份印到 log
+    if args.preview or not args.send or args.verbose:
+        send_email(content, preview=True)
 
     # 儲存至 stock 資料夾，檔名：當日日期_建議.txt
     save_path = os.path.join(stock_dir, f"{today}_建議.txt")
@@ -451,14 +465,17 @@ if __name__ == "__main__":
         f.write(content)
     print(f"\n完整信件已儲存至: {save_path}")
 
-    if preview_only:
-        print("\n（僅預覽，未寄出。若要寄出請執行：python daily_us_tw_email.py）")
-    elif auto_send:
-        send_email(content, preview=False)
-    else:
-        try:
-            ans = input("\n是否要實際寄出？(y/n): ").strip().lower()
-            if ans == "y":
-                send_email(content, preview=False)
-        except EOFError:
-            pass
+    # 寄信共用一條 SMTP 連線（第一次寄信才連線，預覽時完全不連線），結束時自動關閉
+    with SMTPPool() as pool:
+        if args.preview:
+            print("\n（僅預覽，未寄出。若要寄出請執行：python daily_us_tw_email.py）")
+        elif args.send:
+            send_email(content, pool=pool)
+        else:
+            # 互動模式（本機開發用）
+            try:
+                ans = input("\n是否要實際寄出？(y/n): ").strip().lower()
+                if ans == "y":
+                    send_email(content, pool=pool)
+            except EOFError:
+                pass
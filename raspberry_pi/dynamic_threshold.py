@@ -5,9 +5,18 @@
 自適應能力：市場平靜時更敏銳（低門檻），市場波動大時更穩健（高門檻）
 """
 
+import functools
 import numpy as np
 import pandas as pd
+from datetime import datetime, timedelta
 from typing import Tuple
+from yf_cache import cached_download
+
+try:
+    import bottleneck as bn  # C 實作的滑動標準差，未安裝時改用累積和算法
+    HAS_BOTTLENECK = True
+except ImportError:
+    HAS_BOTTLENECK = False
 
 
 def compute_volatility_regime(us_returns: pd.Series, window: int = 20) -> pd.Series:
@@ -15,8 +24,29 @@ def compute_volatility_regime(us_returns: pd.Series, window: int = 20) -> pd.Ser
     計算滾動波動率（20 日報酬標準差，%）
     市場平靜時 std 小、暴風雨時 std 大
     us_returns 為小數（0.01 = 1%），輸出為百分比
+    有 bottleneck 時用 move_std（單一 C 迴圈）；否則以累積和相減求每個視窗的 Σx、Σx²，
+    O(N) 算出樣本標準差。兩者皆與 rolling().std() 相同
     """
-    return us_returns.rolling(window=window).std() * 100
+    r = us_returns.to_numpy(dtype=np.float64)
+    if HAS_BOTTLENECK and len(r) >= window > 1:
+        vol = bn.move_std(r, window=window, min_count=window, ddof=1)
+        return pd.Series(vol * 100, index=us_returns.index)
+
+    valid = ~np.isnan(r)
+    x = np.where(valid, r, 0.0)
+    cs = np.concatenate(([0.0], np.cumsum(x)))
+    cs2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    cnt = np.concatenate(([0], np.cumsum(valid)))
+
+    vol = np.full(len(r), np.nan)
+    if len(r) >= window > 1:
+        sum_w = cs[window:] - cs[:-window]
+        sum2_w = cs2[window:] - cs2[:-window]
+        var = (sum2_w - sum_w * sum_w / window) / (window - 1)
+        std = np.sqrt(np.maximum(var, 0.0))
+        # 視窗內有缺值時與 pandas 相同回傳 NaN
+        vol[window - 1:] = np.where(cnt[window:] - cnt[:-window] == window, std, np.nan)
+    return pd.Series(vol * 100, index=us_returns.index)
 
 
 def get_dynamic_threshold(
@@ -32,20 +62,46 @@ def get_dynamic_threshold(
     - 波動率低（市場平靜）：門檻較低，更敏銳
     - 波動率高（市場暴風雨）：門檻較高，更穩健
 
-    :param vol_pct: 當前 20 日波動率（%）
+    :param vol_pct: 當前 20 日波動率（%）；傳入陣列時逐元素計算，回傳兩個陣列
     :return: (crash_threshold, surge_threshold) 皆為負數/正數的百分比
     """
-    if np.isnan(vol_pct) or vol_pct <= 0:
-        return -1.0, 1.0  # 預設
+    if np.ndim(vol_pct) > 0:
+        return get_dynamic_threshold_vec(vol_pct, base_low, base_high, vol_low, vol_high)
+    return _get_dynamic_threshold_cached(float(vol_pct), base_low, base_high, vol_low, vol_high)
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_dynamic_threshold_cached(
+    vol_pct: float,
+    base_low: float,
+    base_high: float,
+    vol_low: float,
+    vol_high: float
+) -> Tuple[float, float]:
+    """純函式結果以 LRU 快取：逐標的回測迴圈會對同一天的波動率重複查詢"""
+    crash, surge = get_dynamic_threshold_vec(
+        np.array([vol_pct], dtype=np.float64), base_low, base_high, vol_low, vol_high
+    )
+    return float(crash[0]), float(surge[0])
 
-    # 線性插值：vol_low → base_low, vol_high → base_high
-    if vol_pct <= vol_low:
-        t = base_low
-    elif vol_pct >= vol_high:
-        t = base_high
-    else:
-        t = base_low + (base_high - base_low) * (vol_pct - vol_low) / (vol_high - vol_low)
 
+def get_dynamic_threshold_vec(
+    vol_pct: np.ndarray,
+    base_low: float = 0.7,
+    base_high: float = 1.8,
+    vol_low: float = 0.6,
+    vol_high: float = 1.4
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    get_dynamic_threshold 的陣列版本：一次計算整段波動率的門檻
+    :param vol_pct: 20 日波動率（%）陣列
+    :return: (crash_thresholds, surge_thresholds) 陣列
+    """
+    vol = np.asarray(vol_pct, dtype=np.float64)
+    # 線性插值：vol_low → base_low, vol_high → base_high，兩端以 clip 夾住
+    frac = np.clip((vol - vol_low) / (vol_high - vol_low), 0.0, 1.0)
+    t = base_low + (base_high - base_low) * frac
+    t = np.where(np.isnan(vol) | (vol <= 0), 1.0, t)  # 預設
     return -t, t
 
 
@@ -53,7 +109,9 @@ def apply_dynamic_threshold(
     us_df: pd.DataFrame,
     window: int = 20,
     base_low: float = 0.7,
-    base_high: float = 1.8
+    base_high: float = 1.8,
+    vol_low: float = 0.6,
+    vol_high: float = 1.4
 ) -> pd.DataFrame:
     """
     對美股資料加上每日動態門檻
@@ -66,8 +124,41 @@ def apply_dynamic_threshold(
     vol = compute_volatility_regime(us["us_ret"], window)  # %
     us["vol_20d"] = vol
 
-    thresholds = [get_dynamic_threshold(v, base_low, base_high) for v in us["vol_20d"]]
-    us["threshold_crash"] = [t[0] for t in thresholds]
-    us["threshold_surge"] = [t[1] for t in thresholds]
+    th_crash, th_surge = get_dynamic_threshold_vec(vol.to_numpy(), base_low, base_high, vol_low, vol_high)
+    us["threshold_crash"] = th_crash
+    us["threshold_surge"] = th_surge
 
     return us
+
+
+def build_us_context(
+    ticker: str = "QQQ",
+    days: int = 400,
+    window: int = 20,
+    base_low: float = 0.7,
+    base_high: float = 1.8,
+    vol_low: float = 0.6,
+    vol_high: float = 1.4,
+    ttl: float = 60 * 60
+) -> pd.DataFrame:
+    """
+    下載美股資料並一次算好波動率與每日門檻，供各回測與報告共用
+    :param days: 往回取的日曆天數（需涵蓋最長回測區間 + 波動率窗口）
+    :param ttl: 下載快取有效秒數（預設 1 小時，避免拿到過期收盤）
+    :return: 含 Close, us_ret, vol_20d, threshold_crash, threshold_surge 的 DataFrame；取不到資料時為空
+    """
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    us = cached_download(
+        ticker,
+        start=start.strftime("%Y-%m-%d"),
+        end=end.strftime("%Y-%m-%d"),
+        progress=False,
+        auto_adjust=True,
+        ttl=ttl,
+    )
+    if isinstance(us.columns, pd.MultiIndex):
+        us.columns = us.columns.get_level_values(0)
+    if us.empty or "Close" not in us.columns:
+        return pd.DataFrame(columns=["Close", "us_ret", "vol_20d", "threshold_crash", "threshold_surge"])
+    return apply_dynamic_threshold(us, window, base_low, base_high, vol_low, vol_high)
@@ -9,12 +9,94 @@
 import pandas as pd
 import numpy as np
 from typing import Optional, Tuple
+from numba_compat import njit, HAS_NUMBA
+
+try:
+    import bottleneck as bn  # C 實作的滑動視窗 max/min，未安裝時退回 pandas rolling
+    HAS_BOTTLENECK = True
+except ImportError:
+    HAS_BOTTLENECK = False
+
+
+@njit(cache=True)
+def _rolling_extreme(arr, window, is_max):
+    """
+    單調佇列 O(N) 滑動視窗最大/最小值（numba 編譯）：佇列只保留可能成為極值的索引，
+    另計視窗內缺值筆數，有缺值或不足 window 筆時為 NaN
+    """
+    n = arr.shape[0]
+    out = np.full(n, np.nan)
+    q = np.empty(n, np.int64)
+    head = tail = 0
+    n_nan = 0
+    for i in range(n):
+        x = arr[i]
+        if x != x:
+            n_nan += 1
+        else:
+            while tail > head and ((arr[q[tail - 1]] <= x) if is_max else (arr[q[tail - 1]] >= x)):
+                tail -= 1
+            q[tail] = i
+            tail += 1
+        if i >= window:
+            old = arr[i - window]
+            if old != old:
+                n_nan -= 1
+        while tail > head and q[head] <= i - window:
+            head += 1
+        if i >= window - 1 and n_nan == 0:
+            out[i] = arr[q[head]]
+    return out
+
+
+def _rolling_max(arr: np.ndarray, window: int) -> np.ndarray:
+    """
+    滑動視窗最大值，視窗內有缺值或不足 window 筆時為 NaN（同 pandas rolling）
+    依序使用 bottleneck、numba 單調佇列，皆未安裝時退回 pandas rolling
+    """
+    if HAS_BOTTLENECK and len(arr) >= window:
+        return bn.move_max(arr, window=window, min_count=window)
+    if HAS_NUMBA:
+        return _rolling_extreme(arr, window, True)
+    return pd.Series(arr).rolling(window=window).max().to_numpy()
+
+
+def _rolling_min(arr: np.ndarray, window: int) -> np.ndarray:
+    """滑動視窗最小值，規則同 _rolling_max"""
+    if HAS_BOTTLENECK and len(arr) >= window:
+        return bn.move_min(arr, window=window, min_count=window)
+    if HAS_NUMBA:
+        return _rolling_extreme(arr, window, False)
+    return pd.Series(arr).rolling(window=window).min().to_numpy()
+
+
+def _safe_div(num: np.ndarray, denom: np.ndarray) -> np.ndarray:
+    """num / denom，分母為 0 或 NaN 時結果為 NaN"""
+    out = np.full(num.shape, np.nan)
+    np.divide(num, denom, out=out, where=denom != 0)
+    return out
 
 
 # =============================================================================
 # 一、均線類 (Moving Averages)
 # =============================================================================
 
+# SMA 的卷積核（全 1），依 period 保留一份，逐檔計算時不再重新配置
+_SMA_KERNELS: dict[int, np.ndarray] = {}
+
+
+def _sma_np(arr: np.ndarray, period: int) -> np.ndarray:
+    """以 np.convolve 計算滑動平均；視窗內有缺值時為 NaN、前 period-1 筆為 NaN（同 pandas rolling）"""
+    kernel = _SMA_KERNELS.get(period)
+    if kernel is None:
+        kernel = _SMA_KERNELS[period] = np.ones(period)
+    out = np.full(len(arr), np.nan)
+    if len(arr) >= period:
+        # 先加總再除以 period：連續相同價格時結果精確等於該價格
+        out[period - 1:] = np.convolve(arr, kernel, mode="valid") / period
+    return out
+
+
 def sma(series: pd.Series, period: int = 20) -> pd.Series:
     """
     簡單移動平均線 (Simple Moving Average, SMA)
@@ -23,7 +105,35 @@ def sma(series: pd.Series, period: int = 20) -> pd.Series:
     公式：SMA = (P1 + P2 + ... + Pn) / n
     常用週期：5(短)、20(中)、60(長)
     """
-    return series.rolling(window=period).mean()
+    return pd.Series(_sma_np(series.to_numpy(dtype=np.float64), period), index=series.index, name=series.name)
+
+
+@njit(cache=True)
+def _ewm_update(s, w, x, a):
+    """pandas ewm(adjust=False) 單步遞迴：缺值日沿用前值，舊權重仍逐日衰減；回傳 (新值, 新權重)"""
+    if s == s:
+        w *= 1.0 - a
+        if x == x:
+            if s != x:
+                s = (w * s + a * x) / (w + a)
+            w = 1.0
+    elif x == x:
+        s = x
+    return s, w
+
+
+@njit(cache=True)
+def _ema_kernel(x, period):
+    """EMA 單迴圈計算（numba 編譯），結果與 pandas ewm(span, adjust=False).mean() 相同"""
+    n = x.shape[0]
+    out = np.full(n, np.nan)
+    a = 2.0 / (period + 1)
+    s = np.nan
+    w = 1.0
+    for i in range(n):
+        s, w = _ewm_update(s, w, x[i], a)
+        out[i] = s
+    return out
 
 
 def ema(series: pd.Series, period: int = 12) -> pd.Series:
@@ -35,7 +145,7 @@ def ema(series: pd.Series, period: int = 12) -> pd.Series:
           α = 2 / (period + 1)
     常用週期：12、26（常與 MACD 搭配）
     """
-    return series.ewm(span=period, adjust=False).mean()
+    return pd.Series(_ema_kernel(series.to_numpy(dtype=np.float64), period), index=series.index, name=series.name)
 
 
 def wma(series: pd.Series, period: int = 20) -> pd.Series:
@@ -45,16 +155,45 @@ def wma(series: pd.Series, period: int = 20) -> pd.Series:
     用途：對近期價格賦予更高權重，比 SMA 更敏感。
     公式：WMA = (P1×1 + P2×2 + ... + Pn×n) / (1+2+...+n)
     """
-    weights = np.arange(1, period + 1)
-    return series.rolling(window=period).apply(
-        lambda x: np.dot(x, weights) / weights.sum(), raw=True
-    )
+    weights = np.arange(1, period + 1, dtype=np.float64)
+    arr = series.to_numpy(dtype=np.float64)
+    out = np.full(len(arr), np.nan)
+    if len(arr) >= period:
+        # convolve 會翻轉權重，故傳入反序權重；valid 長度 n-period+1，前面補 NaN
+        out[period - 1:] = np.convolve(arr, weights[::-1] / weights.sum(), mode="valid")
+    return pd.Series(out, index=series.index, name=series.name)
 
 
 # =============================================================================
 # 二、動能指標 (Momentum Indicators)
 # =============================================================================
 
+@njit(cache=True)
+def _rsi_kernel(close, period):
+    """
+    RSI 單迴圈計算（numba 編譯）：漲跌幅以 Wilder 平滑 alpha=1/period，
+    與 pandas ewm(alpha, min_periods=period) 預設的 adjust=True 加權平均相同
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    w = 1.0 - 1.0 / period
+    gain_num = loss_num = den = 0.0
+    for i in range(n):
+        delta = close[i] - close[i - 1] if i > 0 else np.nan
+        # 缺值（含第一天）視為 0，與 Series.where 相同
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        gain_num = gain + w * gain_num
+        loss_num = loss + w * loss_num
+        den = 1.0 + w * den
+        if i >= period - 1:
+            avg_loss = loss_num / den
+            # 平均跌幅為 0 時 RS 取 0（同原本 replace(0, inf) 的結果）
+            rs = (gain_num / den) / avg_loss if avg_loss != 0 else 0.0
+            out[i] = 100.0 - 100.0 / (1.0 + rs)
+    return out
+
+
 def rsi(series: pd.Series, period: int = 14) -> pd.Series:
     """
     相對強弱指標 (Relative Strength Index, RSI)
@@ -63,13 +202,48 @@ def rsi(series: pd.Series, period: int = 14) -> pd.Series:
     公式：RSI = 100 - 100/(1 + RS)，RS = 平均漲幅 / 平均跌幅
     解讀：>70 超買、<30 超賣、50 附近為多空均衡
     """
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0.0)
-    loss = (-delta).where(delta < 0, 0.0)
-    avg_gain = gain.ewm(alpha=1/period, min_periods=period).mean()
-    avg_loss = loss.ewm(alpha=1/period, min_periods=period).mean()
-    rs = avg_gain / avg_loss.replace(0, np.inf)
-    return 100 - (100 / (1 + rs))
+    return pd.Series(_rsi_kernel(series.to_numpy(dtype=np.float64), period), index=series.index, name=series.name)
+
+
+@njit(cache=True)
+def _macd_kernel(close, fast, slow, signal):
+    """
+    MACD 單迴圈計算（numba 編譯）：一次走訪同時更新 EMA(fast)、EMA(slow) 與 DEA，
+    遞迴與 pandas ewm(span, adjust=False) 相同——缺值日沿用前值，舊權重仍逐日衰減
+    """
+    n = close.shape[0]
+    dif = np.full(n, np.nan)
+    dea = np.full(n, np.nan)
+    a_f = 2.0 / (fast + 1)
+    a_s = 2.0 / (slow + 1)
+    a_g = 2.0 / (signal + 1)
+    ef = es = g = np.nan
+    wf = ws = wg = 1.0
+    for i in range(n):
+        x = close[i]
+        if ef == ef:
+            wf *= 1.0 - a_f
+            ws *= 1.0 - a_s
+            if x == x:
+                if ef != x:
+                    ef = (wf * ef + a_f * x) / (wf + a_f)
+                if es != x:
+                    es = (ws * es + a_s * x) / (ws + a_s)
+                wf = ws = 1.0
+        elif x == x:
+            ef = es = x
+        if ef == ef:
+            d = ef - es
+            if g == g:
+                wg *= 1.0 - a_g
+                if g != d:
+                    g = (wg * g + a_g * d) / (wg + a_g)
+                wg = 1.0
+            else:
+                g = d
+            dif[i] = d
+            dea[i] = g
+    return dif, dea
 
 
 def macd(
@@ -88,12 +262,14 @@ def macd(
         MACD柱 = (DIF - DEA) × 2
     解讀：DIF 上穿 DEA 為金叉(多)、下穿為死叉(空)
     """
-    ema_fast = ema(series, fast)
-    ema_slow = ema(series, slow)
-    dif = ema_fast - ema_slow
-    dea = ema(dif, signal)
+    dif, dea = _macd_kernel(series.to_numpy(dtype=np.float64), fast, slow, signal)
     macd_hist = (dif - dea) * 2
-    return dif, dea, macd_hist
+    idx, name = series.index, series.name
+    return (
+        pd.Series(dif, index=idx, name=name),
+        pd.Series(dea, index=idx, name=name),
+        pd.Series(macd_hist, index=idx, name=name),
+    )
 
 
 def stochastic(
@@ -113,9 +289,11 @@ def stochastic(
     L14/H14 為 14 日內最低/最高價
     解讀：K>80 超買、K<20 超賣
     """
-    lowest_low = low.rolling(window=k_period).min()
-    highest_high = high.rolling(window=k_period).max()
-    k = 100 * (close - lowest_low) / (highest_high - lowest_low).replace(0, np.nan)
+    lowest_low = _rolling_min(low.to_numpy(dtype=np.float64), k_period)
+    highest_high = _rolling_max(high.to_numpy(dtype=np.float64), k_period)
+    k_arr = _safe_div(close.to_numpy(dtype=np.float64) - lowest_low, highest_high - lowest_low)
+    k_arr *= 100
+    k = pd.Series(k_arr, index=close.index)
     d = k.rolling(window=d_period).mean()
     return k, d
 
@@ -138,15 +316,62 @@ def williams_r(high: pd.Series, low: pd.Series, close: pd.Series, period: int =
     公式：%R = (H14 - C) / (H14 - L14) × (-100)
     解讀：> -20 超買、< -80 超賣
     """
-    highest = high.rolling(window=period).max()
-    lowest = low.rolling(window=period).min()
-    return -100 * (highest - close) / (highest - lowest).replace(0, np.nan)
+    highest = _rolling_max(high.to_numpy(dtype=np.float64), period)
+    lowest = _rolling_min(low.to_numpy(dtype=np.float64), period)
+    out = _safe_div(highest - close.to_numpy(dtype=np.float64), highest - lowest)
+    out *= -100
+    return pd.Series(out, index=close.index)
 
 
 # =============================================================================
 # 三、波動率指標 (Volatility Indicators)
 # =============================================================================
 
+@njit(cache=True)
+def _rolling_mean_std(x, period):
+    """
+    滑動平均與樣本標準差一次走訪算完（numba 編譯）：Welford 加入新值、移除舊值，
+    不用 E[X²]-E[X]² 以免大數相減失真；視窗內有缺值時為 NaN（同 pandas rolling）
+    """
+    n = x.shape[0]
+    mean_out = np.full(n, np.nan)
+    std_out = np.full(n, np.nan)
+    nobs = 0
+    mean = ssqdm = 0.0
+    prev = np.nan
+    same = 0  # 連續相同值的個數，滿一整個視窗時標準差直接為 0
+    for i in range(n):
+        if i >= period:
+            old = x[i - period]
+            if old == old:
+                nobs -= 1
+                if nobs == 0:
+                    mean = ssqdm = 0.0
+                else:
+                    delta = old - mean
+                    mean -= delta / nobs
+                    ssqdm -= delta * (old - mean)
+        v = x[i]
+        if v == v:
+            nobs += 1
+            delta = v - mean
+            mean += delta / nobs
+            ssqdm += delta * (v - mean)
+            same = same + 1 if v == prev else 1
+        else:
+            same = 0
+        prev = v
+        if nobs == period:
+            if same >= period:
+                mean_out[i] = v
+                std_out[i] = 0.0 if period > 1 else np.nan
+            else:
+                mean_out[i] = mean
+                if period > 1:
+                    std_out[i] = np.sqrt(max(ssqdm, 0.0) / (period - 1))
+    return mean_out, std_out
+
+
 def bollinger_bands(
     series: pd.Series,
     period: int = 20,
@@ -162,11 +387,43 @@ def bollinger_bands(
         下軌 = 中軌 - k × 標準差
     常用：k=2，period=20
     """
-    middle = sma(series, period)
-    std = series.rolling(window=period).std()
-    upper = middle + std_dev * std
-    lower = middle - std_dev * std
-    return upper, middle, lower
+    mean, std = _rolling_mean_std(series.to_numpy(dtype=np.float64), period)
+    idx, name = series.index, series.name
+    return (
+        pd.Series(mean + std_dev * std, index=idx, name=name),
+        pd.Series(mean, index=idx, name=name),
+        pd.Series(mean - std_dev * std, index=idx, name=name),
+    )
+
+
+@njit(cache=True)
+def _atr_kernel(high, low, close, period):
+    """
+    ATR 單迴圈計算（numba 編譯）：逐日取三種 TR 的最大值（略過缺值，同 DataFrame.max），
+    接著以 pandas ewm(span, adjust=False) 相同的遞迴平滑
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    a = 2.0 / (period + 1)
+    s = np.nan
+    w = 1.0
+    for i in range(n):
+        pc = close[i - 1] if i > 0 else np.nan
+        tr = np.nan
+        for x in (high[i] - low[i], abs(high[i] - pc), abs(low[i] - pc)):
+            if x == x and not (tr >= x):
+                tr = x
+        if s == s:
+            w *= 1.0 - a
+            if tr == tr:
+                if s != tr:
+                    s = (w * s + a * tr) / (w + a)
+                w = 1.0
+        elif tr == tr:
+            s = tr
+        if s == s:
+            out[i] = s
+    return out
 
 
 def atr(high: pd.Series, low: pd.Series, close: pd.Series, period: int = 14) -> pd.Series:
@@ -177,18 +434,42 @@ def atr(high: pd.Series, low: pd.Series, close: pd.Series, period: int = 14) ->
     公式：TR = max(H-L, |H-PC|, |L-PC|)，ATR = EMA(TR)
     PC = 前一日收盤
     """
-    prev_close = close.shift(1)
-    tr1 = high - low
-    tr2 = (high - prev_close).abs()
-    tr3 = (low - prev_close).abs()
-    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-    return tr.ewm(span=period, adjust=False).mean()
+    out = _atr_kernel(
+        high.to_numpy(dtype=np.float64),
+        low.to_numpy(dtype=np.float64),
+        close.to_numpy(dtype=np.float64),
+        period,
+    )
+    return pd.Series(out, index=close.index)
 
 
 # =============================================================================
 # 四、成交量指標 (Volume Indicators)
 # =============================================================================
 
+@njit(cache=True)
+def _obv_kernel(close, volume):
+    """
+    OBV 單迴圈累加（numba 編譯）：漲跌方向以布林相減取代 np.sign，
+    缺值日輸出 NaN 但不中斷累加（同 pandas cumsum 略過 NaN）
+    """
+    n = close.shape[0]
+    out = np.empty(n)
+    acc = 0.0
+    for i in range(n):
+        if i == 0:
+            step = 0.0 * volume[0]
+        else:
+            c, pc = close[i], close[i - 1]
+            step = (int(c > pc) - int(c < pc)) * volume[i] if c == c and pc == pc else np.nan
+        if step == step:
+            acc += step
+            out[i] = acc
+        else:
+            out[i] = np.nan
+    return out
+
+
 def obv(close: pd.Series, volume: pd.Series) -> pd.Series:
     """
     能量潮 (On Balance Volume, OBV)
@@ -196,9 +477,8 @@ def obv(close: pd.Series, volume: pd.Series) -> pd.Series:
     用途：量價關係，OBV 上升表示買盤積極。
     公式：收盤漲則 OBV += 成交量，跌則 OBV -= 成交量
     """
-    direction = np.sign(close.diff())
-    direction.iloc[0] = 0
-    return (direction * volume).cumsum()
+    out = _obv_kernel(close.to_numpy(dtype=np.float64), volume.to_numpy(dtype=np.float64))
+    return pd.Series(out, index=close.index)
 
 
 def mfi(
@@ -216,13 +496,65 @@ def mfi(
          MFI = 100 - 100/(1 + 正資金流總和/負資金流總和)
     解讀：>80 超買、<20 超賣
     """
-    typical_price = (high + low + close) / 3
-    money_flow = typical_price * volume
-    delta = typical_price.diff()
-    pos_flow = money_flow.where(delta > 0, 0).rolling(window=period).sum()
-    neg_flow = money_flow.where(delta < 0, 0).rolling(window=period).sum()
-    mfi_ratio = pos_flow / neg_flow.replace(0, np.nan)
-    return 100 - (100 / (1 + mfi_ratio))
+    return _mfi_from_typical((high + low + close) / 3, volume, period)
+
+
+@njit(cache=True)
+def _mfi_kernel(typical, volume, period):
+    """
+    MFI 單迴圈計算（numba 編譯）：正/負資金流的 period 日總和以「加新值、減舊值」累加，
+    另計視窗內缺值與非零筆數——有缺值時為 NaN（同 rolling），全為 0 時總和取精確的 0
+    """
+    n = typical.shape[0]
+    out = np.full(n, np.nan)
+    pos = np.zeros(n)
+    neg = np.zeros(n)
+    pos_sum = neg_sum = 0.0
+    pos_nan = neg_nan = pos_nz = neg_nz = 0
+    for i in range(n):
+        delta = typical[i] - typical[i - 1] if i > 0 else np.nan
+        mf = typical[i] * volume[i]
+        # 漲跌不明（缺值）的日子兩邊皆記 0，同 Series.where
+        pos[i] = mf if delta > 0 else 0.0
+        neg[i] = mf if delta < 0 else 0.0
+        if i >= period:
+            p, q = pos[i - period], neg[i - period]
+            if p != p:
+                pos_nan -= 1
+            elif p != 0.0:
+                pos_nz -= 1
+                pos_sum -= p
+            if q != q:
+                neg_nan -= 1
+            elif q != 0.0:
+                neg_nz -= 1
+                neg_sum -= q
+        p, q = pos[i], neg[i]
+        if p != p:
+            pos_nan += 1
+        elif p != 0.0:
+            pos_nz += 1
+            pos_sum += p
+        if q != q:
+            neg_nan += 1
+        elif q != 0.0:
+            neg_nz += 1
+            neg_sum += q
+        if i >= period - 1 and pos_nan == 0 and neg_nan == 0 and neg_nz > 0:
+            # 負資金流為 0 時比值為 NaN（同原本 replace(0, nan)）
+            ratio = (pos_sum if pos_nz > 0 else 0.0) / neg_sum
+            out[i] = 100 - (100 / (1 + ratio))
+        if pos_nz == 0:
+            pos_sum = 0.0
+        if neg_nz == 0:
+            neg_sum = 0.0
+    return out
+
+
+def _mfi_from_typical(typical_price: pd.Series, volume: pd.Series, period: int) -> pd.Series:
+    """MFI 本體：傳入已算好的典型價（add_all_indicators 與 CCI 共用同一份）"""
+    out = _mfi_kernel(typical_price.to_numpy(dtype=np.float64), volume.to_numpy(dtype=np.float64), period)
+    return pd.Series(out, index=typical_price.index)
 
 
 # =============================================================================
@@ -243,12 +575,75 @@ def cci(
          MD = 平均絕對偏差
     解讀：>100 超買、<-100 超賣
     """
-    typical = (high + low + close) / 3
+    return _cci_from_typical((high + low + close) / 3, period)
+
+
+def _cci_from_typical(typical: pd.Series, period: int) -> pd.Series:
+    """CCI 本體：傳入已算好的典型價（add_all_indicators 與 MFI 共用同一份）"""
     sma_tp = typical.rolling(window=period).mean()
-    mad = typical.rolling(window=period).apply(lambda x: np.abs(x - x.mean()).mean(), raw=True)
+    a = typical.to_numpy(dtype=np.float64)
+    mad = np.full(len(a), np.nan)
+    if len(a) >= period:
+        # 二維滑動視窗一次算完所有視窗的平均絕對偏差；視窗內有缺值時為 NaN（同 rolling）
+        w = np.lib.stride_tricks.sliding_window_view(a, period)
+        mad[period - 1:] = np.abs(w - w.mean(axis=1, keepdims=True)).mean(axis=1)
+    mad = pd.Series(mad, index=typical.index)
     return (typical - sma_tp) / (0.015 * mad.replace(0, np.nan))
 
 
+@njit(cache=True)
+def _div(num, denom):
+    """純量除法，除以 0 時同 pandas：0/0 為 NaN、其餘為 ±inf"""
+    if denom == 0.0:
+        if num == 0.0 or num != num:
+            return np.nan
+        return np.inf if num > 0 else -np.inf
+    return num / denom
+
+
+@njit(cache=True)
+def _adx_kernel(high, low, close, period):
+    """
+    ADX 單迴圈計算（numba 編譯）：+DM/-DM、TR 與四組 EMA（TR、+DM、-DM、DX）
+    在同一次走訪中更新，回傳 (+DI, -DI, ADX)
+    """
+    n = close.shape[0]
+    plus_di = np.full(n, np.nan)
+    minus_di = np.full(n, np.nan)
+    adx_out = np.full(n, np.nan)
+    a = 2.0 / (period + 1)
+    tr_last = atr_s = pdm_s = mdm_s = adx_s = np.nan
+    w_tr = w_p = w_m = w_x = 1.0
+    for i in range(n):
+        if i > 0:
+            up = high[i] - high[i - 1]
+            dn = low[i - 1] - low[i]
+            pc = close[i - 1]
+        else:
+            up = dn = pc = np.nan
+        # 缺值視為 0；-DM 與「已歸零後」的 +DM 比較，同原本兩次 where 的順序
+        pdm = up if (up > dn and up > 0) else 0.0
+        mdm = dn if (dn > pdm and dn > 0) else 0.0
+        tr = np.nan
+        for x in (high[i] - low[i], abs(high[i] - pc), abs(low[i] - pc)):
+            if x == x and not (tr >= x):
+                tr = x
+        # TR 缺值日沿用前一日（同 atr(period=1)）
+        if tr == tr:
+            tr_last = tr
+        atr_s, w_tr = _ewm_update(atr_s, w_tr, tr_last, a)
+        pdm_s, w_p = _ewm_update(pdm_s, w_p, pdm, a)
+        mdm_s, w_m = _ewm_update(mdm_s, w_m, mdm, a)
+        pdi = 100 * _div(pdm_s, atr_s)
+        mdi = 100 * _div(mdm_s, atr_s)
+        dx = _div(100 * abs(pdi - mdi), pdi + mdi)
+        adx_s, w_x = _ewm_update(adx_s, w_x, dx, a)
+        plus_di[i] = pdi
+        minus_di[i] = mdi
+        adx_out[i] = adx_s
+    return plus_di, minus_di, adx_out
+
+
 def adx(
     high: pd.Series,
     low: pd.Series,
@@ -262,65 +657,63 @@ def adx(
     公式：+DM、-DM、TR → +DI、-DI → DX → ADX = EMA(DX)
     解讀：ADX 上升 = 趨勢增強；+DI>-DI 多頭、反之空頭
     """
-    plus_dm = high.diff()
-    minus_dm = -low.diff()
-    plus_dm = plus_dm.where((plus_dm > minus_dm) & (plus_dm > 0), 0)
-    minus_dm = minus_dm.where((minus_dm > plus_dm) & (minus_dm > 0), 0)
-
-    tr = atr(high, low, close, 1)  # period=1 即 TR 本身
-
-    atr_smooth = tr.ewm(span=period, adjust=False).mean()
-    plus_di = 100 * (plus_dm.ewm(span=period, adjust=False).mean() / atr_smooth)
-    minus_di = 100 * (minus_dm.ewm(span=period, adjust=False).mean() / atr_smooth)
-
-    dx = 100 * (plus_di - minus_di).abs() / (plus_di + minus_di)
-    adx_val = dx.ewm(span=period, adjust=False).mean()
-
-    return plus_di, minus_di, adx_val
+    plus_di, minus_di, adx_val = _adx_kernel(
+        high.to_numpy(dtype=np.float64),
+        low.to_numpy(dtype=np.float64),
+        close.to_numpy(dtype=np.float64),
+        period,
+    )
+    idx = close.index
+    return pd.Series(plus_di, index=idx), pd.Series(minus_di, index=idx), pd.Series(adx_val, index=idx)
 
 
 # =============================================================================
 # 六、整合函式：一次計算所有技術指標
 # =============================================================================
 
-def add_all_indicators(df: pd.DataFrame) -> pd.DataFrame:
+def add_all_indicators(df: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
     """
     將所有技術指標加入 DataFrame
     --------------------------
     輸入：含 Open, High, Low, Close, Volume 的 OHLCV DataFrame
     輸出：加上各技術指標欄位的 DataFrame
+    dtype：指標欄位的儲存型別；np.float32 可減半記憶體（計算仍以 float64 進行，避免 EMA 等遞迴累積誤差）
     """
-    result = df.copy()
     o, h, l, c = df["Open"], df["High"], df["Low"], df["Close"]
     v = df["Volume"] if "Volume" in df.columns else pd.Series(0, index=df.index)
+    typical = (h + l + c) / 3  # MFI 與 CCI 共用
+    # 新欄位先收集在 dict，最後一次 concat，避免逐欄 __setitem__ 反覆調整 DataFrame 內部結構
+    cols = {}
 
     # 均線
-    result["SMA_5"] = sma(c, 5)
-    result["SMA_20"] = sma(c, 20)
-    result["SMA_60"] = sma(c, 60)
-    result["EMA_12"] = ema(c, 12)
-    result["EMA_26"] = ema(c, 26)
+    cols["SMA_5"] = sma(c, 5)
+    cols["SMA_20"] = sma(c, 20)
+    cols["SMA_60"] = sma(c, 60)
+    cols["EMA_12"] = ema(c, 12)
+    cols["EMA_26"] = ema(c, 26)
 
     # 動能
-    result["RSI_14"] = rsi(c, 14)
-    dif, dea, macd_hist = macd(c, 12, 26, 9)
-    result["MACD_DIF"] = dif
-    result["MACD_DEA"] = dea
-    result["MACD_Hist"] = macd_hist
-    result["Stoch_K"], result["Stoch_D"] = stochastic(h, l, c, 14, 3)
-    result["ROC_12"] = roc(c, 12)
-    result["Williams_R"] = williams_r(h, l, c, 14)
+    cols["RSI_14"] = rsi(c, 14)
+    cols["MACD_DIF"], cols["MACD_DEA"], cols["MACD_Hist"] = macd(c, 12, 26, 9)
+    cols["Stoch_K"], cols["Stoch_D"] = stochastic(h, l, c, 14, 3)
+    cols["ROC_12"] = roc(c, 12)
+    cols["Williams_R"] = williams_r(h, l, c, 14)
 
     # 波動率
-    result["BB_Upper"], result["BB_Middle"], result["BB_Lower"] = bollinger_bands(c, 20, 2)
-    result["ATR_14"] = atr(h, l, c, 14)
+    cols["BB_Upper"], cols["BB_Middle"], cols["BB_Lower"] = bollinger_bands(c, 20, 2)
+    cols["ATR_14"] = atr(h, l, c, 14)
 
     # 成交量
-    result["OBV"] = obv(c, v)
-    result["MFI_14"] = mfi(h, l, c, v, 14)
+    cols["OBV"] = obv(c, v)
+    cols["MFI_14"] = _mfi_from_typical(typical, v, 14)
 
     # 趨勢
-    result["CCI_20"] = cci(h, l, c, 20)
-    result["ADX_Plus"], result["ADX_Minus"], result["ADX_14"] = adx(h, l, c, 14)
-
-    return result
+    cols["CCI_20"] = _cci_from_typical(typical, 20)
+    cols["ADX_Plus"], cols["ADX_Minus"], cols["ADX_14"] = adx(h, l, c, 14)
+
+    indicators = pd.DataFrame(cols, index=df.index)
+    if np.dtype(dtype) != np.float64:
+        indicators = indicators.astype(dtype)
+    # 重複計算時（df 已含指標欄位）以新值取代
+    base = df.drop(columns=[col for col in cols if col in df.columns])
+    return pd.concat([base, indicators], axis=1)
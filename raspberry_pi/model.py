@@ -5,12 +5,15 @@ LSTM 預測模型 - 基本時間序列預測
 使用 PyTorch 實作單向 LSTM，為股市預測常用的深度學習架構。
 """
 
+import os
+import copy
 import numpy as np
 import pandas as pd
 import torch
 import torch.nn as nn
 from sklearn.preprocessing import StandardScaler
 from typing import Optional
+from numba_compat import njit, prange, HAS_NUMBA
 
 
 class LSTMModel(nn.Module):
@@ -49,11 +52,23 @@ class LSTMModel(nn.Module):
         return self.fc(last_out)
 
 
+@njit(parallel=True, cache=True)
+def _build_sequences(data, target_col_idx, seq_len, pred_horizon, X, y):
+    """將 data 切成滑動視窗寫入預先配置的 X, y（numba 平行編譯）"""
+    n_feat = data.shape[1]
+    for i in prange(X.shape[0]):
+        for t in range(seq_len):
+            for f in range(n_feat):
+                X[i, t, f] = data[i + t, f]
+        y[i] = data[i + seq_len + pred_horizon - 1, target_col_idx]
+
+
 def create_sequences(
     data: np.ndarray,
     target_col_idx: int,
     seq_len: int = 60,
-    pred_horizon: int = 1
+    pred_horizon: int = 1,
+    use_numba: Optional[bool] = None
 ) -> tuple[np.ndarray, np.ndarray]:
     """
     建立 LSTM 的輸入序列與標籤
@@ -61,13 +76,27 @@ def create_sequences(
     :param target_col_idx: 預測目標的欄位索引（通常是收盤價）
     :param seq_len: 輸入序列長度（過去幾天）
     :param pred_horizon: 預測未來幾天
+    :param use_numba: 是否使用 numba 編譯版本；None 表示有安裝 numba 就使用
     :return: X (N, seq_len, F), y (N,)
     """
-    X, y = [], []
-    for i in range(seq_len, len(data) - pred_horizon + 1):
-        X.append(data[i - seq_len:i])
-        y.append(data[i + pred_horizon - 1, target_col_idx])
-    return np.array(X, dtype=np.float32), np.array(y, dtype=np.float32)
+    if use_numba is None:
+        use_numba = HAS_NUMBA
+    n = max(len(data) - pred_horizon + 1 - seq_len, 0)
+    if use_numba:
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        X = np.empty((n, seq_len, data.shape[1]), dtype=np.float32)
+        y = np.empty(n, dtype=np.float32)
+        _build_sequences(data, target_col_idx, seq_len, pred_horizon, X, y)
+        return X, y
+
+    data = np.asarray(data)
+    if n == 0:
+        return np.empty((0, seq_len, data.shape[1]), dtype=np.float32), np.empty(0, dtype=np.float32)
+    # 零複製的滑動視窗 (N, F, seq_len) → 轉成 (N, seq_len, F)，只在轉 float32 時複製一次
+    windows = np.lib.stride_tricks.sliding_window_view(data, seq_len, axis=0)[:n].transpose(0, 2, 1)
+    X = np.ascontiguousarray(windows, dtype=np.float32)
+    y = data[seq_len + pred_horizon - 1:seq_len + pred_horizon - 1 + n, target_col_idx].astype(np.float32)
+    return X, y
 
 
 def train_lstm(
@@ -77,13 +106,30 @@ def train_lstm(
     epochs: int = 100,
     hidden_size: int = 64,
     lr: float = 0.001,
-    device: Optional[str] = None
+    device: Optional[str] = None,
+    batch_size: int = 256,
+    accum_steps: int = 1,
+    use_compile: bool = False
 ) -> LSTMModel:
     """
-    訓練 LSTM 模型
+    訓練 LSTM 模型（mini-batch）
+    :param batch_size: 每批樣本數
+    :param accum_steps: 梯度累積批數，GPU 記憶體小時可調大以模擬更大的批次
+    :param use_compile: 以 torch.compile 固定形狀編譯後訓練（PyTorch 2.x）；首次需編譯時間，適合 epoch 數多時
+    :return: 未編譯的模型（與編譯版共用權重），可直接存檔或量化
     """
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    use_cuda = torch.device(device).type == "cuda"
+    if use_cuda:
+        # 輸入形狀固定，讓 cuDNN 挑選最快的 LSTM kernel
+        torch.backends.cudnn.benchmark = True
+        # Ampere 以上 GPU 的 float32 矩陣乘法改用 TF32
+        torch.set_float32_matmul_precision("high")
+    else:
+        # CPU（如樹莓派）：用滿所有核心並啟用 MKL-DNN
+        torch.set_num_threads(os.cpu_count() or 1)
+        torch.backends.mkldnn.enabled = True
 
     model = LSTMModel(
         input_size=input_size,
@@ -91,36 +137,118 @@ def train_lstm(
         num_layers=2,
         dropout=0.2
     ).to(device)
+    runner = model
+    if use_compile and hasattr(torch, "compile"):
+        # 批次形狀固定（最後一批另編一次），GPU 用 CUDA graphs 減少每步 kernel 啟動開銷
+        runner = torch.compile(model, mode="reduce-overhead" if use_cuda else "default", dynamic=False)
 
     criterion = nn.MSELoss()
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-
-    X_t = torch.tensor(X_train, dtype=torch.float32).to(device)
-    y_t = torch.tensor(y_train, dtype=torch.float32).unsqueeze(1).to(device)
+    # GPU 上用 fused Adam：所有參數的更新合成單一 kernel，減少每步的 kernel 啟動次數
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, fused=use_cuda)
+    # GPU 上以 FP16 混合精度訓練，GradScaler 避免梯度下溢
+    scaler = torch.amp.GradScaler("cuda", enabled=use_cuda)
+
+    # 整份訓練資料只搬到裝置上一次（GPU 時經 pinned memory 非同步傳輸），
+    # 之後每個 epoch 直接在裝置上洗牌切批次，不再逐批 CPU→GPU 複製
+    X_t = torch.from_numpy(np.ascontiguousarray(X_train, dtype=np.float32))
+    y_t = torch.from_numpy(np.ascontiguousarray(y_train, dtype=np.float32)).unsqueeze(1)
+    if use_cuda:
+        X_t, y_t = X_t.pin_memory(), y_t.pin_memory()
+    X_t = X_t.to(device, non_blocking=True)
+    y_t = y_t.to(device, non_blocking=True)
+    n = len(X_t)
+    n_batches = (n + batch_size - 1) // batch_size
 
     model.train()
     for epoch in range(epochs):
-        optimizer.zero_grad()
-        out = model(X_t)
-        loss = criterion(out, y_t)
-        loss.backward()
-        optimizer.step()
+        epoch_loss = 0.0
+        optimizer.zero_grad(set_to_none=True)
+        perm = torch.randperm(n, device=X_t.device)
+        for step, start in enumerate(range(0, n, batch_size), 1):
+            idx = perm[start:start + batch_size]
+            xb, yb = X_t[idx], y_t[idx]
+            with torch.autocast(device_type="cuda", dtype=torch.float16, enabled=use_cuda):
+                out = runner(xb)
+            loss = criterion(out.float(), yb)
+            scaler.scale(loss / accum_steps).backward()
+            if step % accum_steps == 0 or step == n_batches:
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+            epoch_loss += loss.detach() * len(xb)
         if (epoch + 1) % 20 == 0:
-            print(f"  Epoch {epoch+1}/{epochs}, Loss: {loss.item():.6f}")
+            print(f"  Epoch {epoch+1}/{epochs}, Loss: {epoch_loss.item() / n:.6f}")
 
     return model
 
 
+# 推論用的裝置端輸入暫存區，依 (裝置, seq_len, F) 保留一份，重複預測時不再重新配置 GPU 記憶體
+_infer_buffers: dict[tuple, torch.Tensor] = {}
+
+
+def _infer_buffer(shape: tuple, device) -> torch.Tensor:
+    """取得至少可放 shape[0] 筆的裝置端暫存區（不足時才重新配置），回傳前 shape[0] 筆的 view"""
+    key = (str(device), tuple(shape[1:]))
+    buf = _infer_buffers.get(key)
+    if buf is None or buf.shape[0] < shape[0]:
+        buf = torch.empty(shape, dtype=torch.float32, device=device)
+        _infer_buffers[key] = buf
+    return buf[:shape[0]]
+
+
 def predict_lstm(
     model: LSTMModel,
     X: np.ndarray,
-    device: Optional[str] = None
+    device: Optional[str] = None,
+    use_compile: bool = False
 ) -> np.ndarray:
-    """使用訓練好的 LSTM 預測"""
+    """
+    使用訓練好的 LSTM 預測
+    :param use_compile: 以 torch.compile 編譯後推論（PyTorch 2.x）；首次呼叫需編譯時間，適合同一模型重複預測
+    """
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
     model.eval()
-    with torch.no_grad():
-        X_t = torch.tensor(X, dtype=torch.float32).to(device)
-        pred = model(X_t).cpu().numpy().flatten()
+    runner = model
+    if use_compile and hasattr(torch, "compile"):
+        # GPU 用 CUDA graphs 減少每次 kernel 啟動開銷；CPU 用預設模式
+        runner = torch.compile(model, mode="reduce-overhead" if str(device).startswith("cuda") else "default")
+    # float32 連續陣列直接共用記憶體轉成 tensor；GPU 時複製進重複使用的暫存區；inference_mode 不記錄 autograd 資訊
+    X_cpu = torch.from_numpy(np.ascontiguousarray(X, dtype=np.float32))
+    if torch.device(device).type == "cuda":
+        X_t = _infer_buffer(tuple(X_cpu.shape), device)
+        X_t.copy_(X_cpu, non_blocking=True)
+    else:
+        X_t = X_cpu
+    with torch.inference_mode():
+        pred = runner(X_t).float().cpu().numpy().ravel()
     return pred
+
+
+def _use_qnnpack() -> None:
+    """ARM（樹莓派）上的 int8 運算使用 qnnpack 引擎"""
+    if "qnnpack" in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = "qnnpack"
+
+
+def export_int8(model: LSTMModel, path: str, meta: Optional[dict] = None) -> None:
+    """
+    將訓練好的模型做 int8 動態量化並存成 TorchScript，供樹莓派直接載入推論（不需重新訓練）
+    LSTM / Linear 權重轉 int8，推論時以 qnnpack 執行；另存 float 權重於 *_fp32.pt
+    :param path: int8 TorchScript 檔路徑（如 lstm_int8.pt）
+    :param meta: 一併存入 float 權重檔的資訊（特徵欄位、標準化參數等）
+    """
+    float_model = copy.deepcopy(model).cpu().eval()
+    float_path = os.path.splitext(path)[0] + "_fp32.pt"
+    torch.save({"state_dict": float_model.state_dict(), "meta": meta or {}}, float_path)
+
+    _use_qnnpack()
+    qmodel = torch.ao.quantization.quantize_dynamic(float_model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    torch.jit.save(torch.jit.script(qmodel), path)
+    print(f"int8 模型已儲存至: {path}（float 權重: {float_path}）")
+
+
+def load_int8(path: str) -> torch.jit.ScriptModule:
+    """載入 export_int8 產出的 int8 模型（CPU），可直接傳入 predict_lstm(..., device="cpu")"""
+    _use_qnnpack()
+    return torch.jit.load(path, map_location="cpu")
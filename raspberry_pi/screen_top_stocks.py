@@ -7,11 +7,16 @@
 3. 篩選勝率與報酬率最高的 20 檔
 """
 
-import yfinance as yf
+import json
+import os
+import time
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dynamic_threshold import apply_dynamic_threshold, get_dynamic_threshold
+from dynamic_threshold import build_us_context, get_dynamic_threshold_vec
+from backtest_kernels import label_hold
+from yf_cache import cached_download
 
 US_TICKER = "QQQ"
 BASE_LOW, BASE_HIGH = 0.7, 1.8
@@ -76,27 +81,46 @@ TOP_50_STOCKS = {
 }
 
 
-def fetch_us_data(days: int = 120) -> pd.DataFrame:
-    """取得美股 QQQ 資料"""
-    end = datetime.now()
-    start = end - timedelta(days=days)
-    us = yf.download(
-        US_TICKER,
-        start=start.strftime("%Y-%m-%d"),
-        end=end.strftime("%Y-%m-%d"),
-        progress=False,
-        auto_adjust=True
-    )
-    if isinstance(us.columns, pd.MultiIndex):
-        us.columns = us.columns.get_level_values(0)
-    return us
+# 資料不足（下載不到或共同交易日太少）的標的記在此檔，INSUFFICIENT_DAYS 天內不再下載
+INSUFFICIENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "insufficient.json")
+INSUFFICIENT_DAYS = 7
+
+_insufficient: dict[str, float] | None = None
+
+
+def _insufficient_tickers() -> dict[str, float]:
+    """讀取資料不足名單 {ticker: 記錄時間}，已過期的項目略過"""
+    global _insufficient
+    if _insufficient is None:
+        try:
+            with open(INSUFFICIENT_PATH, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        cutoff = time.time() - INSUFFICIENT_DAYS * 86400
+        _insufficient = {t: ts for t, ts in data.items() if ts >= cutoff}
+    return _insufficient
+
+
+def _mark_insufficient(ticker: str) -> None:
+    """將標的加入資料不足名單並寫檔；無法寫檔時僅保留在記憶體"""
+    tickers = _insufficient_tickers()
+    tickers[ticker] = time.time()
+    try:
+        os.makedirs(os.path.dirname(INSUFFICIENT_PATH), exist_ok=True)
+        with open(INSUFFICIENT_PATH, "w", encoding="utf-8") as f:
+            json.dump(tickers, f)
+    except OSError:
+        pass
 
 
 def fetch_tw_data(ticker: str, days: int = 120) -> pd.DataFrame:
-    """取得台股資料"""
+    """取得台股資料；近期資料不足的標的直接回傳空表，不連線下載"""
+    if ticker in _insufficient_tickers():
+        return pd.DataFrame()
     end = datetime.now()
     start = end - timedelta(days=days)
-    tw = yf.download(
+    tw = cached_download(
         ticker,
         start=start.strftime("%Y-%m-%d"),
         end=end.strftime("%Y-%m-%d"),
@@ -108,58 +132,127 @@ def fetch_tw_data(ticker: str, days: int = 120) -> pd.DataFrame:
     return tw
 
 
-def backtest_single_stock(ticker: str, name: str, us_e: pd.DataFrame) -> dict | None:
+def fetch_tw_panel(days: int = 120) -> dict[str, pd.DataFrame]:
+    """
+    一次取得全部 50 檔台股資料（單一 multi-ticker 請求，yfinance 內部多執行緒下載）
+    批次請求失敗或漏掉的標的，改以執行緒平行逐檔下載
+    :param days: 往回取的天數
+    :return: {ticker: DataFrame} 字典；取不到資料及近期資料不足的標的不列入
+    """
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    skip = _insufficient_tickers()
+    tickers = [t for t in TOP_50_STOCKS if t not in skip]
+    if not tickers:
+        return {}
+    try:
+        data = cached_download(
+            tickers,
+            start=start.strftime("%Y-%m-%d"),
+            end=end.strftime("%Y-%m-%d"),
+            progress=False,
+            auto_adjust=True,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception:
+        data = pd.DataFrame()
+
+    result = {}
+    if isinstance(data.columns, pd.MultiIndex):
+        available = set(data.columns.get_level_values(0))
+        for ticker in tickers:
+            if ticker in available:
+                # 各檔交易日不同，合併後需去掉該檔全為 NaN 的日期
+                df = data[ticker].dropna(how="all")
+                if not df.empty:
+                    result[ticker] = df
+    # 批次有取到其他標的，代表網路正常，單檔仍抓不到才可能是資料不足；
+    # 整批失敗（如斷線）時不能因此把所有標的列入資料不足名單
+    batch_ok = bool(result)
+
+    # 批次中單檔失敗時 yfinance 會回傳整欄 NaN（可能只是暫時被限流），先單獨重抓確認；
+    # 網路 I/O 會釋放 GIL，逐檔下載以執行緒平行；map 保持原順序
+    def _fetch_one(ticker):
+        try:
+            return fetch_tw_data(ticker, days=days)
+        except Exception:
+            return None
+
+    missing = [t for t in tickers if t not in result]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+            for ticker, df in zip(missing, ex.map(_fetch_one, missing)):
+                if df is None:
+                    continue
+                if not df.empty:
+                    result[ticker] = df
+                elif batch_ok:
+                    # 仍無資料（如已下市）才列入資料不足名單
+                    _mark_insufficient(ticker)
+    # 依 TOP_50_STOCKS 的順序回傳
+    return {t: result[t] for t in tickers if t in result}
+
+
+def _align(us_e: pd.DataFrame, tw: pd.DataFrame) -> pd.DataFrame:
+    """美股與台股以共同交易日 inner join 一次，之後改用 numpy 陣列的位置索引計算"""
+    return us_e[["us_ret", "vol_20d"]].join(tw[["Open", "High", "Close"]], how="inner").sort_index()
+
+
+def _backtest_aligned(aligned: pd.DataFrame, hold_days: int, n_forward: int):
+    """
+    對 _align 的結果回測，依前一日美股漲跌分成大跌/大漲/持平三組
+    :return: 三組各自的 (次數, 勝率%, 均報酬%)
+    """
+    us_ret = aligned["us_ret"].to_numpy(dtype=np.float64)
+    buy_idx, win, ret = label_hold(
+        aligned["Open"].to_numpy(dtype=np.float64),
+        aligned["High"].to_numpy(dtype=np.float64),
+        aligned["Close"].to_numpy(dtype=np.float64),
+        us_ret,
+        hold_days,
+        n_forward,
+    )
+    # 門檻用 prev_d（買入日前一個共同交易日）當下的波動率
+    prev_idx = buy_idx - 1
+    us_pct = us_ret[prev_idx] * 100
+    th_c, th_s = get_dynamic_threshold_vec(aligned["vol_20d"].to_numpy()[prev_idx], BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
+    is_crash = us_pct < th_c
+    is_surge = ~is_crash & (us_pct > th_s)
+    is_flat = ~(is_crash | is_surge)
+
+    def stats(mask):
+        n = int(mask.sum())
+        if n == 0:
+            return 0, 0, 0
+        return n, win[mask].sum() / n * 100, ret[mask].mean()
+
+    return stats(is_crash), stats(is_surge), stats(is_flat)
+
+
+def backtest_single_stock(ticker: str, name: str, us_e: pd.DataFrame, tw: pd.DataFrame = None) -> dict | None:
     """
     對單一台股進行回測
+    :param tw: 已下載的台股資料（如 fetch_tw_panel 的結果）；None 則自行下載
     :return: 包含勝率、報酬等統計的 dict，或 None（資料不足）
     """
-    tw = fetch_tw_data(ticker, days=120)
+    if ticker in _insufficient_tickers():
+        return None
+    if tw is None:
+        tw = fetch_tw_data(ticker, days=120)
     if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
         return None
 
-    tw = tw[["Open", "High", "Close"]]
-    common = us_e.index.intersection(tw.index).sort_values()
-
-    if len(common) < 10:
+    aligned = _align(us_e, tw)
+    if len(aligned) < 10:
+        # 有資料但共同交易日太少（如新上市），一段時間內不再下載
+        _mark_insufficient(ticker)
         return None
 
-    crash_list, surge_list, flat_list = [], [], []
-
-    for i in range(1, len(common) - 2):
-        prev_d = common[i - 1]
-        d = common[i]
-        us_ret = us_e.loc[prev_d, "us_ret"] if prev_d in us_e.index else np.nan
-        if np.isnan(us_ret):
-            continue
-
-        vol = us_e.loc[prev_d, "vol_20d"] if "vol_20d" in us_e.columns else 1.0
-        th_c, th_s = get_dynamic_threshold(vol, BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
-
-        buy = tw.loc[d, "Open"]
-        d1, d2, d3 = common[i], common[i + 1], common[i + 2]
-        high_3d = max(tw.loc[d1, "High"], tw.loc[d2, "High"], tw.loc[d3, "High"])
-        ret_3d = (tw.loc[d3, "Close"] / buy - 1) * 100
-        win = high_3d > buy
-
-        us_pct = us_ret * 100
-        if us_pct < th_c:
-            crash_list.append({"win": win, "ret": ret_3d})
-        elif us_pct > th_s:
-            surge_list.append({"win": win, "ret": ret_3d})
-        else:
-            flat_list.append({"win": win, "ret": ret_3d})
-
-    def stats(lst):
-        if not lst:
-            return 0, 0, 0
-        n = len(lst)
-        w = sum(x["win"] for x in lst)
-        r = np.mean([x["ret"] for x in lst])
-        return n, w / n * 100 if n else 0, r
-
-    c_n, c_wr, c_ret = stats(crash_list)
-    s_n, s_wr, s_ret = stats(surge_list)
-    f_n, f_wr, f_ret = stats(flat_list)
+    c_stats, s_stats, f_stats = _backtest_aligned(aligned, hold_days=3, n_forward=2)
+    c_n, c_wr, c_ret = c_stats
+    s_n, s_wr, s_ret = s_stats
+    f_n, f_wr, f_ret = f_stats
 
     # 綜合評分：取大跌買和大漲買中較佳者
     if c_n >= 3 and s_n >= 3:
@@ -195,61 +288,34 @@ def backtest_single_stock(ticker: str, name: str, us_e: pd.DataFrame) -> dict |
 SCREEN_10D_DAYS = 200  # 約 6 個月，含緩衝
 
 
-def backtest_single_stock_10d(ticker: str, name: str, us_e: pd.DataFrame, days: int = SCREEN_10D_DAYS) -> dict | None:
+def backtest_single_stock_10d(
+    ticker: str, name: str, us_e: pd.DataFrame, days: int = SCREEN_10D_DAYS, tw: pd.DataFrame = None
+) -> dict | None:
     """
     對單一台股進行 10 日持有回測（半年資料）
+    :param tw: 已下載的台股資料（如 fetch_tw_panel 的結果）；None 則自行下載
     :return: 包含勝率、報酬等統計的 dict，或 None（資料不足）
     """
-    tw = fetch_tw_data(ticker, days=days)
+    if ticker in _insufficient_tickers():
+        return None
+    if tw is None:
+        tw = fetch_tw_data(ticker, days=days)
     if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
         return None
 
-    tw = tw[["Open", "High", "Close"]]
-    common = us_e.index.intersection(tw.index).sort_values()
+    aligned = _align(us_e, tw)
     hold_days = 10
     need_forward = hold_days + 1
 
-    if len(common) < need_forward:
+    if len(aligned) < need_forward:
+        # 有資料但共同交易日太少（如新上市），一段時間內不再下載
+        _mark_insufficient(ticker)
         return None
 
-    crash_list, surge_list, flat_list = [], [], []
-
-    for i in range(1, len(common) - need_forward):
-        prev_d = common[i - 1]
-        d = common[i]
-        us_ret = us_e.loc[prev_d, "us_ret"] if prev_d in us_e.index else np.nan
-        if np.isnan(us_ret):
-            continue
-
-        vol = us_e.loc[prev_d, "vol_20d"] if "vol_20d" in us_e.columns else 1.0
-        th_c, th_s = get_dynamic_threshold(vol, BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
-
-        buy = tw.loc[d, "Open"]
-        hold_indices = [common[i + j] for j in range(hold_days)]
-        high_hold = max(tw.loc[dd, "High"] for dd in hold_indices)
-        close_last = tw.loc[hold_indices[-1], "Close"]
-        ret_hold = (close_last / buy - 1) * 100
-        win = high_hold > buy
-
-        us_pct = us_ret * 100
-        if us_pct < th_c:
-            crash_list.append({"win": win, "ret": ret_hold})
-        elif us_pct > th_s:
-            surge_list.append({"win": win, "ret": ret_hold})
-        else:
-            flat_list.append({"win": win, "ret": ret_hold})
-
-    def stats(lst):
-        if not lst:
-            return 0, 0, 0
-        n = len(lst)
-        w = sum(x["win"] for x in lst)
-        r = np.mean([x["ret"] for x in lst])
-        return n, w / n * 100 if n else 0, r
-
-    c_n, c_wr, c_ret = stats(crash_list)
-    s_n, s_wr, s_ret = stats(surge_list)
-    f_n, f_wr, f_ret = stats(flat_list)
+    c_stats, s_stats, f_stats = _backtest_aligned(aligned, hold_days=hold_days, n_forward=need_forward)
+    c_n, c_wr, c_ret = c_stats
+    s_n, s_wr, s_ret = s_stats
+    f_n, f_wr, f_ret = f_stats
 
     if c_n >= 3 and s_n >= 3:
         best_strategy = "大跌買" if c_ret > s_ret else "大漲買"
@@ -279,21 +345,22 @@ def backtest_single_stock_10d(ticker: str, name: str, us_e: pd.DataFrame, days:
     }
 
 
-def run_screening_10d() -> list[dict]:
+def run_screening_10d(us_ctx: pd.DataFrame = None) -> list[dict]:
     """
     執行 50 檔股票 10 日持有回測篩選（半年資料）
+    :param us_ctx: build_us_context 產生的美股資料；None 則自行下載
     :return: 排序後的結果列表
     """
-    us = fetch_us_data(days=SCREEN_10D_DAYS)
-    if us.empty or len(us) < 30:
+    if us_ctx is None:
+        us_ctx = build_us_context(US_TICKER, days=SCREEN_10D_DAYS, base_low=BASE_LOW, base_high=BASE_HIGH)
+    us_e = us_ctx
+    if us_e.empty or len(us_e) < 30:
         return []
 
-    us_e = apply_dynamic_threshold(us, 20, BASE_LOW, BASE_HIGH)
-    us_e["us_ret"] = us_e["Close"].pct_change()
-
+    panel = fetch_tw_panel(days=SCREEN_10D_DAYS)
     results = []
     for ticker, name in TOP_50_STOCKS.items():
-        r = backtest_single_stock_10d(ticker, name, us_e, days=SCREEN_10D_DAYS)
+        r = backtest_single_stock_10d(ticker, name, us_e, days=SCREEN_10D_DAYS, tw=panel.get(ticker, pd.DataFrame()))
         if r:
             results.append(r)
 
@@ -328,9 +395,10 @@ def get_top20_recommendations_10d(results: list[dict], min_ret: float = MIN_RET_
     return crash_buy, surge_buy
 
 
-def run_screening() -> list[dict]:
+def run_screening(us_ctx: pd.DataFrame = None) -> list[dict]:
     """
     執行全部 50 檔股票篩選
+    :param us_ctx: build_us_context 產生的美股資料；None 則自行下載
     :return: 排序後的結果列表
     """
     print("=" * 60)
@@ -342,20 +410,20 @@ def run_screening() -> list[dict]:
 
     # 取得美股資料
     print("\n[1/3] 取得美股 QQQ 資料...")
-    us = fetch_us_data(days=120)
-    if us.empty or len(us) < 30:
+    if us_ctx is None:
+        us_ctx = build_us_context(US_TICKER, days=120, base_low=BASE_LOW, base_high=BASE_HIGH)
+    us_e = us_ctx
+    if us_e.empty or len(us_e) < 30:
         print("無法取得美股資料")
         return []
 
-    us_e = apply_dynamic_threshold(us, 20, BASE_LOW, BASE_HIGH)
-    us_e["us_ret"] = us_e["Close"].pct_change()
-
-    # 逐一回測
+    # 一次下載全部台股後逐一回測
     print(f"\n[2/3] 回測 {len(TOP_50_STOCKS)} 檔股票...")
+    panel = fetch_tw_panel(days=120)
     results = []
     for idx, (ticker, name) in enumerate(TOP_50_STOCKS.items(), 1):
         print(f"  ({idx:2}/{len(TOP_50_STOCKS)}) {name} ({ticker})...", end=" ")
-        r = backtest_single_stock(ticker, name, us_e)
+        r = backtest_single_stock(ticker, name, us_e, tw=panel.get(ticker, pd.DataFrame()))
         if r:
             print(f"勝率 {r['best_wr']:.0f}%  報酬 {r['best_ret']:+.2f}%  {r['best_strategy']}")
             results.append(r)
@@ -419,7 +487,6 @@ def get_recommendations(results: list[dict]) -> tuple[list[str], list[str]]:
 
 def save_results(results: list[dict], top_n: int = 20) -> str:
     """儲存結果至檔案"""
-    import os
     base_dir = os.path.dirname(os.path.abspath(__file__))
     stock_dir = os.path.join(base_dir, "stock")
     os.makedirs(stock_dir, exist_ok=True)
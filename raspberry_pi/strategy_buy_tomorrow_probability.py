@@ -3,12 +3,18 @@
 策略：自動量化交易機制 - 第一步
 ================================
 收集「今日美股漲跌」→ 輸出「建議買入明日台股的機率」
+
+美股資料經 yf_cache 存成 parquet。可在美股收盤後先以 --prefetch 下載一次，
+當天稍後執行時直接讀檔，不必連線。
 """
 
-import yfinance as yf
+import argparse
+import functools
 import pandas as pd
 import numpy as np
+from collections import namedtuple
 from datetime import datetime, timedelta
+from yf_cache import cached_download
 
 # 美股科技指標股（與台股連動高）
 US_STOCKS = {
@@ -19,36 +25,55 @@ US_STOCKS = {
     "QQQ": "那斯達克100",
 }
 
+# 單檔美股的當日漲跌
+UsMove = namedtuple("UsMove", "ticker name chg_pct")
+
 
 def get_us_today_performance() -> dict:
     """
     取得今日（最近交易日）美股漲跌
-    :return: {"up_count": N, "down_count": M, "avg_chg_pct": float, "details": [...]}
+    :return: {"up_count": N, "down_count": M, "avg_chg_pct": float, "details": [UsMove, ...]}
     """
     end = datetime.now()
     start = end - timedelta(days=15)
+    # 所有美股一次下載，再依代碼切出各自的資料
+    try:
+        all_data = cached_download(
+            list(US_STOCKS),
+            start=start.strftime("%Y-%m-%d"),
+            end=end.strftime("%Y-%m-%d"),
+            progress=False,
+            auto_adjust=True,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception:
+        all_data = pd.DataFrame()
+    tickers_ok = set(all_data.columns.get_level_values(0)) if isinstance(all_data.columns, pd.MultiIndex) else set()
+
     details = []
     for ticker, name in US_STOCKS.items():
+        if ticker not in tickers_ok:
+            continue
         try:
-            data = yf.download(ticker, start=start.strftime("%Y-%m-%d"), end=end.strftime("%Y-%m-%d"), progress=False, auto_adjust=True)
-            if isinstance(data.columns, pd.MultiIndex):
-                data.columns = data.columns.get_level_values(0)
+            data = all_data.xs(ticker, axis=1, level=0).dropna(how="all")
             if not data.empty and len(data) >= 2:
                 last = data.iloc[-1]["Close"]
                 prev = data.iloc[-2]["Close"]
                 chg_pct = (last / prev - 1) * 100
-                details.append({"ticker": ticker, "name": name, "chg_pct": chg_pct})
+                details.append(UsMove(ticker, name, float(chg_pct)))
         except Exception:
             pass
 
-    df = pd.DataFrame(details)
-    if df.empty:
+    if not details:
         return {"up_count": 0, "down_count": 0, "avg_chg_pct": 0, "details": []}
 
-    up = (df["chg_pct"] > 0).sum()
-    down = (df["chg_pct"] < 0).sum()
-    avg = df["chg_pct"].mean()
-    return {"up_count": int(up), "down_count": int(down), "avg_chg_pct": avg, "details": df}
+    chg = np.array([r.chg_pct for r in details])
+    valid = chg[~np.isnan(chg)]  # 缺收盤價的不列入平均
+    up = int((chg > 0).sum())
+    down = int((chg < 0).sum())
+    avg = float(valid.mean()) if valid.size else float("nan")
+    return {"up_count": up, "down_count": down, "avg_chg_pct": avg, "details": details}
 
 
 def calc_buy_tomorrow_probability(us_perf: dict) -> float:
@@ -56,9 +81,12 @@ def calc_buy_tomorrow_probability(us_perf: dict) -> float:
     依據今日美股漲跌，計算「建議買入明日台股」的機率
     參考歷史：美股漲時，次日台股上漲機率約 55-65%；美股跌時約 35-45%
     """
-    up = us_perf["up_count"]
-    down = us_perf["down_count"]
-    avg_chg = us_perf["avg_chg_pct"]
+    return _buy_probability_cached(int(us_perf["up_count"]), int(us_perf["down_count"]), float(us_perf["avg_chg_pct"]))
+
+
+@functools.lru_cache(maxsize=256)
+def _buy_probability_cached(up: int, down: int, avg_chg: float) -> float:
+    """純函式結果以 LRU 快取：同一份美股漲跌重複計算時直接查表"""
     total = up + down
     if total == 0:
         return 0.5
@@ -73,21 +101,27 @@ def calc_buy_tomorrow_probability(us_perf: dict) -> float:
     return float(np.clip(prob, 0.1, 0.9))
 
 
+def prefetch() -> None:
+    """只下載今日美股資料並寫入快取（排程於美股收盤後），不輸出機率"""
+    us = get_us_today_performance()
+    print(f"已快取 {len(us['details'])}/{len(US_STOCKS)} 檔美股資料")
+
+
 def run() -> None:
     print("=" * 55)
     print("策略：今日美股 → 明日台股買入機率")
     print("=" * 55)
 
     us = get_us_today_performance()
-    if us["details"].empty:
+    if not us["details"]:
         print("\n無法取得美股資料，請稍後再試。")
         return
 
     print("\n【今日美股漲跌】")
     print("-" * 50)
-    for _, r in us["details"].iterrows():
-        s = "漲" if r["chg_pct"] > 0 else "跌"
-        print(f"  {r['name']:10s} ({r['ticker']:5s})  {s}  {r['chg_pct']:+.2f}%")
+    for r in us["details"]:
+        s = "漲" if r.chg_pct > 0 else "跌"
+        print(f"  {r.name:10s} ({r.ticker:5s})  {s}  {r.chg_pct:+.2f}%")
     print(f"\n  合計：{us['up_count']} 檔漲、{us['down_count']} 檔跌，均漲跌 {us['avg_chg_pct']:+.2f}%")
 
     prob = calc_buy_tomorrow_probability(us)
@@ -108,4 +142,10 @@ def run() -> None:
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="今日美股 → 明日台股買入機率")
+    parser.add_argument("--prefetch", action="store_true", help="只下載美股資料寫入快取，之後執行直接讀檔")
+    args = parser.parse_args()
+    if args.prefetch:
+        prefetch()
+    else:
+        run()
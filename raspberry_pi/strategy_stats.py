@@ -7,15 +7,14 @@
 """
 
 import os
-import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from dynamic_threshold import apply_dynamic_threshold, get_dynamic_threshold
+from backtest_kernels import label_hold
 
-plt.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei"]
-plt.rcParams["axes.unicode_minus"] = False
+# yfinance / dynamic_threshold / Pillow 於用到的函式內才載入：
+# 只呼叫 get_strategy_table 等格式化函式時不必付出載入成本
 
 US_TICKER = "QQQ"
 # 回測區間：往後 3 個月（依執行日動態計算）
@@ -33,10 +32,18 @@ ALL_STOCKS = {
     "2317.TW": "鴻海",
 }
 
+# 依日期快取的美股資料（us_ret、vol_20d）：未傳入 us_ctx 時，同一天內各回測共用一份
+# 長駐程序跨日執行時只保留最近幾天，避免舊日期的資料一直累積
+_us_ctx_cache: dict[str, pd.DataFrame] = {}
+_US_CTX_CACHE_MAX = 4
 
-def fetch_and_backtest() -> dict:
-    """取得歷史回測（最近 3 個月）：大跌買、大漲買、平盤買的勝率與均報酬"""
-    return _fetch_and_backtest_by_days(95)
+
+def fetch_and_backtest(us_ctx: pd.DataFrame = None) -> dict:
+    """
+    取得歷史回測（最近 3 個月）：大跌買、大漲買、平盤買的勝率與均報酬
+    :param us_ctx: build_us_context 產生的美股資料；None 則自行下載
+    """
+    return _fetch_and_backtest_by_days(95, us_ctx)
 
 
 def get_flat_etf_recommendation(stats: dict) -> tuple[str, str]:
@@ -123,17 +130,17 @@ def get_strategy_table(stats: dict) -> str:
     return "\n".join(lines)
 
 
-def fetch_and_backtest_6m() -> dict:
+def fetch_and_backtest_6m(us_ctx: pd.DataFrame = None) -> dict:
     """取得過去半年歷史回測：大跌買、大漲買、平盤買"""
-    return _fetch_and_backtest_by_days(185)  # 約 6 個月
+    return _fetch_and_backtest_by_days(185, us_ctx)  # 約 6 個月
 
 
-def fetch_and_backtest_10d() -> dict:
+def fetch_and_backtest_10d(us_ctx: pd.DataFrame = None) -> dict:
     """
     取得 10 日持有回測：大跌買、大漲買、平盤買
     勝率＝10 日內最高價曾超過買入價；均報酬＝持有至第 10 日收盤的報酬
     """
-    return _fetch_and_backtest_hold_days(95, hold_days=10)
+    return _fetch_and_backtest_hold_days(95, hold_days=10, us_ctx=us_ctx)
 
 
 def get_strategy_table_10d(stats: dict) -> str:
@@ -150,150 +157,157 @@ def get_strategy_table_10d(stats: dict) -> str:
     return "\n".join(lines)
 
 
-def _fetch_and_backtest_by_days(days: int) -> dict:
-    """依指定天數取得回測統計"""
+def _get_us_context(end_str: str) -> pd.DataFrame:
+    """
+    取得 end_str 當天的美股資料，同一天內只下載、計算一次
+    :return: build_us_context 的結果；取不到資料時為空（不快取，下次重試）
+    """
+    us_e = _us_ctx_cache.get(end_str)
+    if us_e is None:
+        from dynamic_threshold import build_us_context
+
+        us_e = build_us_context(US_TICKER, base_low=BASE_LOW, base_high=BASE_HIGH)
+        if not us_e.empty:
+            _us_ctx_cache[end_str] = us_e
+            while len(_us_ctx_cache) > _US_CTX_CACHE_MAX:
+                # dict 依插入順序，最先放入的即最舊的日期
+                _us_ctx_cache.pop(next(iter(_us_ctx_cache)))
+    return us_e
+
+
+def _backtest_ticker(us_cols: pd.DataFrame, tw: pd.DataFrame, hold_days: int, n_forward: int) -> dict:
+    """
+    美股與台股以共同交易日 inner join 一次，轉成 numpy 陣列交給 label_hold 逐日標記，
+    再依前一日美股漲跌與動態門檻分成大跌/大漲/持平三組
+    :param us_cols: 已依日期排序的 us_ret、vol_20d 兩欄（各檔台股共用）；inner join 保留其順序
+    :return: crash/surge/flat 各自的次數、勝率%、均報酬%
+    """
+    from dynamic_threshold import get_dynamic_threshold_vec
+
+    aligned = us_cols.join(tw[["Open", "High", "Close"]], how="inner")
+    arr = aligned.to_numpy(dtype=np.float64)
+    us_ret = arr[:, 0]
+    buy_idx, win, ret = label_hold(arr[:, 2], arr[:, 3], arr[:, 4], us_ret, hold_days, n_forward)
+    # 門檻用 prev_d（買入日前一個共同交易日）當下的波動率
+    prev_idx = buy_idx - 1
+    us_pct = us_ret[prev_idx] * 100
+    th_c, th_s = get_dynamic_threshold_vec(arr[prev_idx, 1], BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
+    is_crash = us_pct < th_c
+    is_surge = ~is_crash & (us_pct > th_s)
+    is_flat = ~(is_crash | is_surge)
+
+    def stats(mask):
+        n = int(mask.sum())
+        if n == 0:
+            return 0, 0, 0
+        return n, win[mask].sum() / n * 100, ret[mask].mean()
+
+    c_n, c_wr, c_ret = stats(is_crash)
+    s_n, s_wr, s_ret = stats(is_surge)
+    f_n, f_wr, f_ret = stats(is_flat)
+    return {
+        "crash_n": c_n, "crash_wr": c_wr, "crash_ret": c_ret,
+        "surge_n": s_n, "surge_wr": s_wr, "surge_ret": s_ret,
+        "flat_n": f_n, "flat_wr": f_wr, "flat_ret": f_ret,
+    }
+
+
+def _download_single(ticker: str, start: str, end: str):
+    """單一標的下載（批次請求的備援）；失敗或無資料時回傳 None"""
+    from yf_cache import cached_download
+
+    try:
+        tw = cached_download(ticker, start=start, end=end, progress=False, auto_adjust=True)
+    except Exception:
+        return None
+    if isinstance(tw.columns, pd.MultiIndex):
+        tw.columns = tw.columns.get_level_values(0)
+    return None if tw.empty else tw
+
+
+def _fetch_tw_panel(start: str, end: str) -> dict:
+    """
+    一次下載 ALL_STOCKS 全部標的（單一 multi-ticker 請求），再依代碼切出各自的資料
+    批次請求失敗或漏掉的標的，改以執行緒平行逐檔下載
+    :return: {ticker: DataFrame}；下載失敗或無資料的標的不在結果中
+    """
+    from yf_cache import cached_download
+
+    try:
+        all_data = cached_download(
+            list(ALL_STOCKS),
+            start=start,
+            end=end,
+            progress=False,
+            auto_adjust=True,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception:
+        all_data = pd.DataFrame()
+    panel = {}
+    if isinstance(all_data.columns, pd.MultiIndex):
+        for ticker in all_data.columns.get_level_values(0).unique():
+            tw = all_data.xs(ticker, axis=1, level=0).dropna(how="all")
+            if not tw.empty:
+                panel[ticker] = tw
+
+    # 網路 I/O 會釋放 GIL，逐檔下載以執行緒平行；map 保持原順序
+    missing = [t for t in ALL_STOCKS if t not in panel]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+            for ticker, tw in zip(missing, ex.map(lambda t: _download_single(t, start, end), missing)):
+                if tw is not None:
+                    panel[ticker] = tw
+    return panel
+
+
+def _fetch_and_backtest_by_days(days: int, us_ctx: pd.DataFrame = None) -> dict:
+    """依指定天數取得回測統計；us_ctx 為共用的美股資料（None 則自行下載）"""
     end = datetime.now()
     start = (end - timedelta(days=days)).strftime("%Y-%m-%d")
     end_str = end.strftime("%Y-%m-%d")
-    us = yf.download(US_TICKER, start="2024-01-01", end=end_str, progress=False, auto_adjust=True)
-    if isinstance(us.columns, pd.MultiIndex):
-        us.columns = us.columns.get_level_values(0)
-    if us.empty or len(us) < 30:
+    us_e = us_ctx if us_ctx is not None else _get_us_context(end_str)
+    if us_e.empty or len(us_e) < 30:
         return {}
 
-    us_e = apply_dynamic_threshold(us, 20, BASE_LOW, BASE_HIGH)
-    us_e["us_ret"] = us_e["Close"].pct_change()
-
     results = {}
+    panel = _fetch_tw_panel(start, end_str)
+    us_cols = us_e[["us_ret", "vol_20d"]].sort_index()  # 各檔共用，只選欄、排序一次
     for ticker, name in ALL_STOCKS.items():
-        tw = yf.download(ticker, start=start, end=end_str, progress=False, auto_adjust=True)
-        if isinstance(tw.columns, pd.MultiIndex):
-            tw.columns = tw.columns.get_level_values(0)
-        if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
+        tw = panel.get(ticker)
+        if tw is None or "Open" not in tw.columns or "High" not in tw.columns:
             continue
 
-        tw = tw[["Open", "High", "Close"]]
-        common = us_e.index.intersection(tw.index).sort_values()
-        crash_list, surge_list, flat_list = [], [], []
-
-        for i in range(1, len(common) - 2):
-            prev_d = common[i - 1]
-            d = common[i]
-            us_ret = us_e.loc[prev_d, "us_ret"] if prev_d in us_e.index else np.nan
-            if np.isnan(us_ret):
-                continue
-
-            vol = us_e.loc[prev_d, "vol_20d"] if prev_d in us_e.index and "vol_20d" in us_e.columns else 1.0
-            th_c, th_s = get_dynamic_threshold(vol, BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
-
-            buy = tw.loc[d, "Open"]
-            d1, d2, d3 = common[i], common[i + 1], common[i + 2]
-            high_3d = max(tw.loc[d1, "High"], tw.loc[d2, "High"], tw.loc[d3, "High"])
-            ret_3d = (tw.loc[d3, "Close"] / buy - 1) * 100
-            win = high_3d > buy
-
-            us_pct = us_ret * 100
-            if us_pct < th_c:
-                crash_list.append({"win": win, "ret": ret_3d})
-            elif us_pct > th_s:
-                surge_list.append({"win": win, "ret": ret_3d})
-            else:
-                flat_list.append({"win": win, "ret": ret_3d})
-
-        def stats(lst):
-            if not lst:
-                return 0, 0, 0
-            n = len(lst)
-            w = sum(x["win"] for x in lst)
-            r = np.mean([x["ret"] for x in lst])
-            return n, w / n * 100 if n else 0, r
-
-        c_n, c_wr, c_ret = stats(crash_list)
-        s_n, s_wr, s_ret = stats(surge_list)
-        f_n, f_wr, f_ret = stats(flat_list)
-
-        results[name] = {
-            "crash_n": c_n, "crash_wr": c_wr, "crash_ret": c_ret,
-            "surge_n": s_n, "surge_wr": s_wr, "surge_ret": s_ret,
-            "flat_n": f_n, "flat_wr": f_wr, "flat_ret": f_ret,
-        }
+        results[name] = _backtest_ticker(us_cols, tw, 3, 2)
 
     return results
 
 
-def _fetch_and_backtest_hold_days(days: int, hold_days: int = 10) -> dict:
+def _fetch_and_backtest_hold_days(days: int, hold_days: int = 10, us_ctx: pd.DataFrame = None) -> dict:
     """
     依指定天數與持有天數取得回測統計
     :param days: 回測區間天數
     :param hold_days: 持有天數（開盤買入，持有至第 hold_days 日收盤）
+    :param us_ctx: build_us_context 產生的美股資料；None 則自行下載
     """
     end = datetime.now()
     start = (end - timedelta(days=days)).strftime("%Y-%m-%d")
     end_str = end.strftime("%Y-%m-%d")
-    us = yf.download(US_TICKER, start="2024-01-01", end=end_str, progress=False, auto_adjust=True)
-    if isinstance(us.columns, pd.MultiIndex):
-        us.columns = us.columns.get_level_values(0)
-    if us.empty or len(us) < 30:
+    us_e = us_ctx if us_ctx is not None else _get_us_context(end_str)
+    if us_e.empty or len(us_e) < 30:
         return {}
 
-    us_e = apply_dynamic_threshold(us, 20, BASE_LOW, BASE_HIGH)
-    us_e["us_ret"] = us_e["Close"].pct_change()
-
     need_forward = hold_days + 1
     results = {}
+    panel = _fetch_tw_panel(start, end_str)
+    us_cols = us_e[["us_ret", "vol_20d"]].sort_index()  # 各檔共用，只選欄、排序一次
     for ticker, name in ALL_STOCKS.items():
-        tw = yf.download(ticker, start=start, end=end_str, progress=False, auto_adjust=True)
-        if isinstance(tw.columns, pd.MultiIndex):
-            tw.columns = tw.columns.get_level_values(0)
-        if tw.empty or "Open" not in tw.columns or "High" not in tw.columns:
+        tw = panel.get(ticker)
+        if tw is None or "Open" not in tw.columns or "High" not in tw.columns:
             continue
 
-        tw = tw[["Open", "High", "Close"]]
-        common = us_e.index.intersection(tw.index).sort_values()
-        crash_list, surge_list, flat_list = [], [], []
-
-        for i in range(1, len(common) - need_forward):
-            prev_d = common[i - 1]
-            d = common[i]
-            us_ret = us_e.loc[prev_d, "us_ret"] if prev_d in us_e.index else np.nan
-            if np.isnan(us_ret):
-                continue
-
-            vol = us_e.loc[prev_d, "vol_20d"] if prev_d in us_e.index and "vol_20d" in us_e.columns else 1.0
-            th_c, th_s = get_dynamic_threshold(vol, BASE_LOW, BASE_HIGH, VOL_LOW, VOL_HIGH)
-
-            buy = tw.loc[d, "Open"]
-            hold_indices = [common[i + j] for j in range(hold_days)]
-            high_hold = max(tw.loc[dd, "High"] for dd in hold_indices)
-            close_last = tw.loc[hold_indices[-1], "Close"]
-            ret_hold = (close_last / buy - 1) * 100
-            win = high_hold > buy
-
-            us_pct = us_ret * 100
-            if us_pct < th_c:
-                crash_list.append({"win": win, "ret": ret_hold})
-            elif us_pct > th_s:
-                surge_list.append({"win": win, "ret": ret_hold})
-            else:
-                flat_list.append({"win": win, "ret": ret_hold})
-
-        def stats(lst):
-            if not lst:
-                return 0, 0, 0
-            n = len(lst)
-            w = sum(x["win"] for x in lst)
-            r = np.mean([x["ret"] for x in lst])
-            return n, w / n * 100 if n else 0, r
-
-        c_n, c_wr, c_ret = stats(crash_list)
-        s_n, s_wr, s_ret = stats(surge_list)
-        f_n, f_wr, f_ret = stats(flat_list)
-
-        results[name] = {
-            "crash_n": c_n, "crash_wr": c_wr, "crash_ret": c_ret,
-            "surge_n": s_n, "surge_wr": s_wr, "surge_ret": s_ret,
-            "flat_n": f_n, "flat_wr": f_wr, "flat_ret": f_ret,
-        }
+        results[name] = _backtest_ticker(us_cols, tw, hold_days, need_forward)
 
     return results
 
@@ -318,31 +332,18 @@ def generate_backtest_chart_6m(save_path: str) -> str | None:
         data.append([name, crash_s, surge_s, flat_s, better])
 
     try:
-        fig, ax = plt.subplots(figsize=(14, len(data) * 0.6 + 3))
-        ax.axis("off")
-        table = ax.table(
-            cellText=data,
-            colLabels=cols,
-            loc="center",
-            cellLoc="center",
-            colColours=["#4472C4"] * 5,
-        )
-        table.auto_set_font_size(False)
-        table.set_fontsize(10)
-        table.scale(1, 2)
         end_d = datetime.now().strftime("%Y-%m-%d")
         start_d = (datetime.now() - timedelta(days=185)).strftime("%Y-%m-%d")
-        plt.title(
+        title = (
             f"過去半年歷史回測表（{start_d} ~ {end_d}）\n"
-            "依動態門檻，持有 3 日內有漲即獲利",
-            fontsize=12
+            "依動態門檻，持有 3 日內有漲即獲利"
         )
-        plt.tight_layout()
         save_dir = os.path.dirname(save_path)
         if save_dir:
             os.makedirs(save_dir, exist_ok=True)
-        plt.savefig(save_path, dpi=150)
-        plt.close()
+        from table_image import save_table_image
+
+        save_table_image(cols, data, title, save_path)
         return save_path
     except Exception:
         return None
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+表格圖片輸出
+============
+回測結果表是靜態格線，直接以 numpy 畫布 + Pillow 繪製文字並存成 PNG，
+不經過 matplotlib 的 Table 繪製流程（在樹莓派上省下大部分繪圖時間）。
+找不到中文字型時，退回 matplotlib（Agg）繪製。
+"""
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# 依序嘗試的中文字型：Windows 微軟正黑體 / 雅黑體，Linux / 樹莓派 Noto CJK、文泉驛
+CJK_FONTS = [
+    "msjh.ttc",
+    "msyh.ttc",
+    "NotoSansCJK-Regular.ttc",
+    "NotoSansCJKtc-Regular.otf",
+    "wqy-microhei.ttc",
+    "wqy-zenhei.ttc",
+]
+
+HEADER_COLOR = (0x44, 0x72, 0xC4)
+
+
+def _load_font(size: int):
+    """載入第一個可用的中文字型，皆不存在時回傳 None"""
+    for name in CJK_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return None
+
+
+def _save_table_matplotlib(cols: list, rows: list, title: str, out_path: str) -> None:
+    """matplotlib 備援：以物件導向 API + Agg 繪製，不初始化 GUI 後端"""
+    import matplotlib
+    from matplotlib.figure import Figure
+
+    matplotlib.rcParams["font.sans-serif"] = ["Microsoft JhengHei", "Microsoft YaHei", "SimHei"]
+    matplotlib.rcParams["axes.unicode_minus"] = False
+    fig = Figure(figsize=(14, len(rows) * 0.5 + 3))
+    ax = fig.subplots()
+    ax.axis("off")
+    table = ax.table(
+        cellText=rows,
+        colLabels=cols,
+        loc="center",
+        cellLoc="center",
+        colColours=["#4472C4"] * len(cols),
+    )
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.scale(1, 2)
+    ax.set_title(title, fontsize=12)
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=150)
+
+
+def save_table_image(cols: list, rows: list, title: str, out_path: str, font_size: int = 16) -> None:
+    """
+    將表格存成 PNG
+    :param cols: 欄位名稱
+    :param rows: 每列的儲存格文字（list of list）
+    :param title: 標題，可含換行
+    :param out_path: 輸出路徑
+    :param font_size: 字型大小（像素）
+    """
+    font = _load_font(font_size)
+    if font is None:
+        _save_table_matplotlib(cols, rows, title, out_path)
+        return
+    title_font = _load_font(font_size + 2)
+
+    cells = [list(map(str, cols))] + [list(map(str, r)) for r in rows]
+    pad_x, row_h, margin = 16, font_size * 2 + 8, 20
+    col_w = [int(max(font.getlength(r[j]) for r in cells)) + pad_x * 2 for j in range(len(cols))]
+    table_w = sum(col_w)
+    title_lines = title.split("\n")
+    line_h = font_size + 12
+    title_h = len(title_lines) * line_h + margin
+    width = table_w + margin * 2
+    height = title_h + row_h * len(cells) + margin
+
+    # 白底畫布與表頭底色直接寫進 uint8 陣列
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    canvas[title_h:title_h + row_h, margin:margin + table_w] = HEADER_COLOR
+    img = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(img)
+
+    for i, line in enumerate(title_lines):
+        draw.text((width / 2, margin / 2 + i * line_h + line_h / 2), line, fill="black", font=title_font, anchor="mm")
+
+    for r, row in enumerate(cells):
+        y = title_h + r * row_h
+        x = margin
+        color = "white" if r == 0 else "black"
+        for j, text in enumerate(row):
+            draw.rectangle([x, y, x + col_w[j], y + row_h], outline="black")
+            draw.text((x + col_w[j] / 2, y + row_h / 2), text, fill=color, font=font, anchor="mm")
+            x += col_w[j]
+
+    img.save(out_path, "PNG", optimize=False, compress_level=1)
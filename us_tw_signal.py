@@ -6,11 +6,22 @@
 美股與台股科技供應鏈高度相關，美股漲可作為台股跟漲的參考。
 """
 
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from config import US_TECH_STOCKS, TECH_STOCKS
+from yf_cache import cached_download
+
+# 計算台股上漲機率時各美股的權重：TSM、NVDA、QQQ 與台股相關性最高；未列出者 0.05
+US_WEIGHTS = {
+    "TSM": 0.25,   # 台積電 ADR 直接連動
+    "NVDA": 0.20,  # 輝達與台積電供應鏈
+    "QQQ": 0.18,   # 納斯達克大盤
+    "AAPL": 0.15,
+    "AMD": 0.12,
+    "MSFT": 0.06,
+    "SMH": 0.04,
+}
 
 
 def fetch_us_tech_returns(lookback_days: int = 5) -> pd.DataFrame:
@@ -22,12 +33,30 @@ def fetch_us_tech_returns(lookback_days: int = 5) -> pd.DataFrame:
     start_str = start.strftime("%Y-%m-%d")
     end_str = end.strftime("%Y-%m-%d")
 
+    # 所有美股一次下載（單一 multi-ticker 請求），再依代碼切出各自的資料
+    try:
+        all_data = cached_download(
+            list(US_TECH_STOCKS),
+            start=start_str,
+            end=end_str,
+            progress=False,
+            auto_adjust=True,
+            group_by="ticker",
+            threads=True,
+        )
+    except Exception as e:
+        # 整批下載失敗：每檔都記錄同一個錯誤
+        return pd.DataFrame({
+            ticker: {"name": name, "ret_1d_pct": np.nan, "ret_5d_pct": np.nan, "up_days": 0, "total_days": 0, "error": str(e)}
+            for ticker, name in US_TECH_STOCKS.items()
+        }).T
+
     result = {}
     for ticker, name in US_TECH_STOCKS.items():
         try:
-            data = yf.download(ticker, start=start_str, end=end_str, progress=False, auto_adjust=True)
-            if isinstance(data.columns, pd.MultiIndex):
-                data.columns = data.columns.get_level_values(0)
+            if not isinstance(all_data.columns, pd.MultiIndex) or ticker not in all_data.columns.get_level_values(0):
+                continue
+            data = all_data.xs(ticker, axis=1, level=0).dropna(how="all")
             if not data.empty and "Close" in data.columns:
                 ret_1d = data["Close"].pct_change().dropna().tail(lookback_days)
                 ret_5d = (data["Close"].iloc[-1] / data["Close"].iloc[-lookback_days - 1] - 1) if len(data) > lookback_days else np.nan
@@ -55,26 +84,13 @@ def calc_taiwan_rise_probability(us_df: pd.DataFrame) -> float:
     if valid.empty:
         return 0.5  # 無資料時給 50%
 
-    # 加權：TSM、NVDA、QQQ 與台股相關性最高
-    weights = {
-        "TSM": 0.25,   # 台積電 ADR 直接連動
-        "NVDA": 0.20,  # 輝達與台積電供應鏈
-        "QQQ": 0.18,   # 納斯達克大盤
-        "AAPL": 0.15,
-        "AMD": 0.12,
-        "MSFT": 0.06,
-        "SMH": 0.04,
-    }
-    total_weight = 0
-    score = 0
-    for ticker, row in valid.iterrows():
-        w = weights.get(ticker, 0.05)
-        # 1 日漲則 +1，跌則 -1；5 日漲則額外加分
-        s = 1 if row["ret_1d_pct"] > 0 else (-1 if row["ret_1d_pct"] < 0 else 0)
-        if "ret_5d_pct" in row and not np.isnan(row.get("ret_5d_pct", np.nan)) and row["ret_5d_pct"] > 0:
-            s += 0.5
-        score += s * w
-        total_weight += w
+    w_arr = valid.index.map(US_WEIGHTS).fillna(0.05).to_numpy(dtype=float)
+    ret1 = valid["ret_1d_pct"].to_numpy(dtype=float)
+    ret5 = valid["ret_5d_pct"].to_numpy(dtype=float) if "ret_5d_pct" in valid.columns else np.full(len(valid), np.nan)
+    # 1 日漲則 +1，跌則 -1；5 日漲則額外加分（NaN > 0 為 False，不加分）
+    s = np.sign(ret1) + 0.5 * (ret5 > 0)
+    score = float(np.dot(s, w_arr))
+    total_weight = float(w_arr.sum())
 
     if total_weight == 0:
         return 0.5
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+yfinance 下載快取模組
+=====================
+將 yf.download 的結果以 parquet 存在本地（.cache/yf），
+有效期限內重複執行直接讀檔，不必重新連線下載。
+快取檔超過 CACHE_MAX_FILES 個時，依最近使用時間淘汰（LRU）。
+"""
+
+import hashlib
+import os
+import time
+import pandas as pd
+import yfinance as yf
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "yf")
+# 日線資料快取有效時間（秒）
+CACHE_TTL = 12 * 60 * 60
+# 磁碟上最多保留的快取檔數
+CACHE_MAX_FILES = 200
+
+# 同一次執行內的記憶體快取，避免重複讀檔
+_memory_cache: dict[str, pd.DataFrame] = {}
+
+
+def _cache_key(tickers, start, end, auto_adjust: bool, group_by: str) -> str:
+    if not isinstance(tickers, str):
+        tickers = " ".join(tickers)
+    raw = f"{tickers}_{start}_{end}_{auto_adjust}_{group_by}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _has_all_tickers(data: pd.DataFrame, tickers, group_by: str) -> bool:
+    """
+    多檔下載時檢查每檔都有資料：yfinance 批次中單檔失敗會回傳整欄 NaN，
+    這種結果不寫入快取，以免當天重跑都沿用缺檔的結果
+    """
+    names = tickers.replace(",", " ").split() if isinstance(tickers, str) else list(tickers)
+    if len(names) <= 1 or not isinstance(data.columns, pd.MultiIndex):
+        return True
+    level = 0 if group_by == "ticker" else data.columns.nlevels - 1
+    available = set(data.columns.get_level_values(level))
+    for name in names:
+        name = name.upper()
+        if name not in available or data.xs(name, axis=1, level=level).isna().all(axis=None):
+            return False
+    return True
+
+
+def _touch(path: str) -> None:
+    """更新存取時間作為 LRU 依據；保留修改時間，不影響 TTL 判斷"""
+    try:
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+    except OSError:
+        pass
+
+
+def _evict(max_files: int = CACHE_MAX_FILES) -> None:
+    """快取檔數超過上限時，刪除最久未使用的檔案"""
+    try:
+        entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".parquet")]
+    except OSError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda e: e.stat().st_atime)
+    for e in entries[:len(entries) - max_files]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
+
+
+def cached_download(
+    tickers,
+    start: str = None,
+    end: str = None,
+    auto_adjust: bool = True,
+    group_by: str = "column",
+    ttl: float = CACHE_TTL,
+    **kwargs
+) -> pd.DataFrame:
+    """
+    與 yf.download 相同用法，先查本地快取，未命中才下載
+    :param tickers: 股票代碼（字串或清單，多檔以空白分隔）
+    :param ttl: 快取有效秒數
+    :return: yf.download 的 DataFrame（回傳副本，可安全修改）
+    """
+    key = _cache_key(tickers, start, end, auto_adjust, group_by)
+    if key in _memory_cache:
+        return _memory_cache[key].copy()
+
+    path = os.path.join(CACHE_DIR, f"{key}.parquet")
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl:
+        try:
+            data = pd.read_parquet(path)
+            _touch(path)
+            _memory_cache[key] = data
+            return data.copy()
+        except Exception:
+            pass  # 快取檔損毀，改為重新下載
+
+    kwargs.setdefault("progress", False)
+    data = yf.download(tickers, start=start, end=end, auto_adjust=auto_adjust, group_by=group_by, **kwargs)
+    if not data.empty and _has_all_tickers(data, tickers, group_by):
+        _memory_cache[key] = data
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            data.to_parquet(path, compression="zstd")
+            _evict()
+        except Exception:
+            pass  # 無法寫檔（如未安裝 pyarrow）時僅使用記憶體快取
+    return data.copy()